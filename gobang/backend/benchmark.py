@@ -0,0 +1,648 @@
+"""
+性能测试，用法：python -m gobang.backend.benchmark [测试名]
+"""
+import argparse
+import copy
+import functools
+import os
+import random
+import timeit
+
+import numpy as np
+
+from gobang.backend.board import Board, symmetry_maps
+from gobang.backend.eval_cache import EvaluationCache
+from gobang.backend.mcts_alphaZero import MCTS, MCTSPlayer
+from gobang.backend.mcts_array import ArrayMCTS
+from gobang.backend.mcts_transposition import TranspositionMCTS
+
+
+def legacy_current_state(board: Board, feat_nums=4) -> np.ndarray:
+    """
+    旧版Board.current_state的实现，每次调用都从states重新构造float64数组，用于对照
+    """
+    square_state = np.zeros((feat_nums, board.width, board.height))
+    if board.states:
+        moves, players = np.array(list(zip(*board.states.items())))
+        move_curr = moves[players == board.current_player]
+        move_oppo = moves[players != board.current_player]
+        square_state[0][move_curr // board.width, move_curr % board.width] = 1.0
+        square_state[1][move_oppo // board.width, move_oppo % board.width] = 1.0
+        square_state[2][board.last_move // board.width, board.last_move % board.width] = 1.0
+    if len(board.states) % 2 == 0:
+        square_state[3][:, :] = 1.0
+    return square_state[:, ::-1, :]
+
+
+def legacy_playout(mcts: MCTS, state: Board):
+    """
+    旧版MCTS._playout的实现：用max和lambda选择，get_value写入_U，update_recursively递归回传，用于对照
+    """
+    node = mcts._root
+    depth = 0
+    while not node.is_leaf():
+        action, node = max(node.children.items(), key=lambda act_node: act_node[1].get_value(mcts._c_puct))
+        state.do_move(action)
+        depth += 1
+    action_priors, leaf_value = mcts._policy(state)
+    end, winner = state.game_end()
+    if not end:
+        node.expand(action_priors)
+    else:
+        if winner == -1:
+            leaf_value = 0.0
+        else:
+            leaf_value = 1.0 if winner == state.get_current_player() else -1.0
+    node.update_recursively(-leaf_value)
+    for _ in range(depth):
+        state.undo_move()
+
+
+def tree_signature(node):
+    """
+    按遍历顺序列出搜索树全部结点的(访问次数, Q值)，用于逐位比较两棵树
+    """
+    signature = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        signature.append((node.n_visits, float(node._Q)))
+        stack.extend(node.children.values())
+    return signature
+
+
+def random_board(size, n_moves, seed=0) -> Board:
+    random.seed(seed)
+    board = Board(size, size)
+    for _ in range(n_moves):
+        board.do_move(random.choice(board.available))
+    return board
+
+
+def fake_policy_value_fn(board: Board):
+    """
+    不依赖网络的策略价值函数：固定的随机先验，价值由局面哈希决定，用于单独测量搜索本身的开销
+    """
+    size = board.width * board.height
+    if size not in _fake_priors:
+        _fake_priors[size] = np.random.RandomState(size).rand(size)
+    legal = board.legal_moves
+    priors = _fake_priors[size][legal]
+    value = (board.zobrist_key % 2001) / 1000.0 - 1.0
+    return zip(legal.tolist(), (priors / priors.sum()).tolist()), value
+
+
+_fake_priors = {}
+
+RESOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+
+
+def load_policy_value_net(size):
+    """
+    加载resources下训练好的模型
+    """
+    from gobang.backend import policy_value_net_pytorch
+    model_file = os.path.join(RESOURCES, "current_policy{0}x{0}.model".format(size))
+    return policy_value_net_pytorch.PolicyValueNet(size, size, model_file=model_file)
+
+
+def random_openings(size, n_positions, n_moves=4, seed=0):
+    """
+    中心附近随机走n_moves步得到的一组开局局面
+    """
+    rng = random.Random(seed)
+    center = [h * size + w for h in range(size // 2 - 2, size // 2 + 2) for w in range(size // 2 - 2, size // 2 + 2)]
+    boards = []
+    for _ in range(n_positions):
+        board = Board(size, size)
+        for move in rng.sample(center, n_moves):
+            board.do_move(move)
+        boards.append(board)
+    return boards
+
+
+def bench_current_state(number=20000):
+    """
+    Board.current_state每次调用的耗时，旧实现需再经ascontiguousarray才能送入网络
+    """
+    for size in (8, 15):
+        for n_moves in (0, size * 2, size * size // 2):
+            board = random_board(size, n_moves)
+            assert (legacy_current_state(board) == board.current_state()).all()
+            legacy = timeit.timeit(lambda: np.ascontiguousarray(legacy_current_state(board)), number=number)
+            current = timeit.timeit(lambda: board.current_state(), number=number)
+            print("{0}x{0}, {1:3d} moves: legacy {2:6.2f}us, current {3:6.2f}us, x{4:.1f}".format(
+                size, n_moves, legacy / number * 1e6, current / number * 1e6, legacy / current))
+
+
+def search_moves(mcts, board: Board, n_moves):
+    """
+    用mcts连续走n_moves步（每步取访问次数最多的动作）
+    :return: Tuple(每步的(动作, 访问次数)，平均每秒模拟次数)
+    """
+    results, speeds = [], []
+    for _ in range(n_moves):
+        acts, probs = mcts.get_move_probs(board)
+        move = acts[int(np.argmax(probs))]
+        results.append(sorted(zip(acts, mcts._root_action_visits()[1])))
+        speeds.append(mcts.playouts_per_second)
+        board.do_move(move)
+        mcts.update_with_move(move)
+        if board.game_end()[0]:
+            break
+    return results, float(np.mean(speeds))
+
+
+def bench_mcts_engines(n_playout=800, n_moves=6):
+    """
+    TreeNode实现的MCTS与数组实现的ArrayMCTS，同样的先验和价值下比较每秒模拟次数，并确认搜索结果一致
+    """
+    for size in (8, 15):
+        tree_results, tree_speed = search_moves(MCTS(fake_policy_value_fn, 5, n_playout, True),
+                                                Board(size, size), n_moves)
+        array_results, array_speed = search_moves(ArrayMCTS(fake_policy_value_fn, 5, n_playout, True),
+                                                  Board(size, size), n_moves)
+        print("{0}x{0}: MCTS {1:7.0f} playouts/s, ArrayMCTS {2:7.0f} playouts/s, x{3:.2f}, same visits: {4}".format(
+            size, tree_speed, array_speed, array_speed / tree_speed, tree_results == array_results))
+
+
+def visit_distribution(mcts, size):
+    acts, visits = mcts._root_action_visits()
+    distribution = np.zeros(size * size)
+    distribution[list(acts)] = visits
+    return distribution / distribution.sum()
+
+
+def bench_batch_search(size=8, n_playout=400, n_positions=8, batch_sizes=(1, 2, 4, 8, 16, 32)):
+    """
+    批量搜索：不同batch_size下的每秒模拟次数，以及走子质量
+    质量以batch_size=1、4倍模拟次数的搜索为参照：最佳落子一致的比例，访问分布的总变差距离
+    """
+    net = load_policy_value_net(size)
+    boards = random_openings(size, n_positions)
+    references = []
+    for board in boards:
+        mcts = MCTS(net.policy_value_fn, 5, 4 * n_playout, True)
+        mcts.get_move_probs(board)
+        references.append(visit_distribution(mcts, size))
+    for batch_size in batch_sizes:
+        speeds, agree, distance = [], 0, []
+        for board, reference in zip(boards, references):
+            mcts = MCTS(net.policy_value_fn, 5, n_playout, True, batch_size=batch_size,
+                        policy_value_batch_fn=net.policy_value_states)
+            mcts.get_move_probs(board)
+            distribution = visit_distribution(mcts, size)
+            speeds.append(mcts.playouts_per_second)
+            agree += int(np.argmax(distribution) == np.argmax(reference))
+            distance.append(0.5 * np.abs(distribution - reference).sum())
+        print("batch_size {:2d}: {:7.0f} playouts/s, best move agrees {}/{}, visit TV distance {:.3f}".format(
+            batch_size, np.mean(speeds), agree, len(boards), np.mean(distance)))
+
+
+def bench_threaded_search(size=15, n_playout=400, n_positions=4, thread_counts=(1, 2, 4, 8)):
+    """
+    多线程搜索：固定模拟次数下每步的耗时
+    """
+    net = load_policy_value_net(size)
+    boards = random_openings(size, n_positions)
+    for n_threads in thread_counts:
+        latency = []
+        for board in boards:
+            mcts = MCTS(net.policy_value_fn, 5, n_playout, True, n_threads=n_threads)
+            start = timeit.default_timer()
+            mcts.get_move_probs(board)
+            latency.append(timeit.default_timer() - start)
+            assert mcts._root.n_visits == n_playout
+        print("{} threads: {:.3f}s per move ({} CPUs)".format(n_threads, np.mean(latency), os.cpu_count()))
+
+
+def bench_transposition(size=8, n_playout=800, n_moves=6):
+    """
+    置换表搜索：每步的置换表命中率、省下的网络评估次数，以及与MCTS相比的速度
+    """
+    net = load_policy_value_net(size)
+    board = random_openings(size, 1)[0]
+    _, tree_speed = search_moves(MCTS(net.policy_value_fn, 5, n_playout, True), copy.deepcopy(board), n_moves)
+    mcts = TranspositionMCTS(net.policy_value_fn, 5, n_playout, True)
+    speeds = []
+    for _ in range(n_moves):
+        acts, probs = mcts.get_move_probs(board)
+        stats = mcts.tt_stats
+        speeds.append(mcts.playouts_per_second)
+        print("move {:3d}: hit rate {:.3f}, nn calls {:4d}, saved {:4d}, table size {}".format(
+            len(board.states), stats["hit_rate"], stats["nn_calls"], stats["nn_calls_saved"], stats["table_size"]))
+        move = acts[int(np.argmax(probs))]
+        board.do_move(move)
+        mcts.update_with_move(move)
+    print("MCTS {:.0f} playouts/s, TranspositionMCTS {:.0f} playouts/s".format(tree_speed, np.mean(speeds)))
+
+
+def equivariant_policy_value_fn(board: Board):
+    """
+    与对称变换可交换的策略价值函数：先验只取决于周围的棋子数，用于检查缓存映射回来的先验是否正确
+    """
+    grid = np.zeros((board.height + 4, board.width + 4))
+    for move in board.states:
+        grid[move // board.width + 2, move % board.width + 2] = 1
+    legal = board.legal_moves
+    priors = [1 + grid[m // board.width:m // board.width + 5, m % board.width:m % board.width + 5].sum() for m in legal]
+    return zip(legal.tolist(), priors), len(board.states) / 100.0
+
+
+def bench_eval_cache(size=8, n_playout=400, n_moves=12, capacity=50000):
+    """
+    评估缓存：对称局面取出的先验与直接评估一致；自我对弈中的命中率和速度
+    """
+    maps = symmetry_maps(size, size)
+    cache = EvaluationCache(equivariant_policy_value_fn, capacity)
+    board = random_board(size, size * 2)
+    moves = [move for move, _ in board.move_stack]
+    for s in range(len(maps)):
+        sym_board = Board(size, size)
+        for move in moves:
+            sym_board.do_move(int(maps[s][move]))
+        expected = dict(equivariant_policy_value_fn(sym_board)[0])
+        cached = dict(cache(sym_board)[0])
+        assert cached.keys() == expected.keys()
+        assert all(abs(cached[m] - expected[m]) < 1e-9 for m in expected)
+    assert (cache.hits, cache.misses) == (len(maps) - 1, 1)
+    print("symmetric lookups: ok")
+
+    net = load_policy_value_net(size)
+    for eval_cache_size in (0, capacity):
+        np.random.seed(0)
+        player = MCTSPlayer(net.policy_value_fn, 5, n_playout, is_self_play=1, undo_search=True,
+                            eval_cache_size=eval_cache_size)
+        board = Board(size, size)
+        start = timeit.default_timer()
+        for _ in range(n_moves):
+            board.do_move(player.get_action(board, temperature=1.0))
+            if board.game_end()[0]:
+                break
+        elapsed = timeit.default_timer() - start
+        cache = player.eval_cache
+        print("eval_cache_size={:6d}: {:.0f} playouts/s{}".format(
+            eval_cache_size, n_playout * len(board.states) / elapsed,
+            ", hit rate {:.3f}, cached {}".format(cache.hit_rate, len(cache)) if cache else ""))
+
+
+def bench_tree_memory(size=15, n_playout=2000, n_moves=4, max_nodes=50000):
+    """
+    大棋盘上搜索树的结点数和内存：不限结点数与限制max_nodes对比
+    """
+    for limit in (None, max_nodes):
+        mcts = MCTS(fake_policy_value_fn, 5, n_playout, True, max_nodes=limit)
+        board = Board(size, size)
+        for _ in range(n_moves):
+            acts, probs = mcts.get_move_probs(board)
+            print("max_nodes={}: move {}, {} nodes, {:.1f} MB, pruned {}, {:.0f} playouts/s".format(
+                limit, len(board.states), mcts.node_count(), mcts.tree_memory() / 2 ** 20, mcts.n_pruned,
+                mcts.playouts_per_second))
+            move = acts[int(np.argmax(probs))]
+            board.do_move(move)
+            mcts.update_with_move(move)
+
+
+def bench_expansion(size=15, n_playout=800, n_positions=4):
+    """
+    扩展策略：完全展开与top-k、累计先验、渐进展开的结点数、内存、速度，以及最终落子与完全展开相同的比例
+    """
+    net = load_policy_value_net(size)
+    boards = random_openings(size, n_positions)
+    policies = (("full", {}), ("top_k=8", {"expand_top_k": 8}), ("prior_mass=0.9", {"expand_prior_mass": 0.9}),
+                ("widening", {"expand_top_k": 4, "widen_exponent": 0.5}))
+    full_moves = None
+    for name, kwargs in policies:
+        nodes, memory, speeds, moves = [], [], [], []
+        for board in boards:
+            mcts = MCTS(net.policy_value_fn, 5, n_playout, True, **kwargs)
+            acts, probs = mcts.get_move_probs(copy.deepcopy(board))
+            nodes.append(mcts.node_count())
+            memory.append(mcts.tree_memory())
+            speeds.append(mcts.playouts_per_second)
+            moves.append(acts[int(np.argmax(probs))])
+        full_moves = full_moves or moves
+        print("{:15s} {:8.0f} nodes, {:6.1f} MB, {:5.0f} playouts/s, same move {}/{}".format(
+            name, np.mean(nodes), np.mean(memory) / 2 ** 20, np.mean(speeds),
+            sum(a == b for a, b in zip(moves, full_moves)), len(moves)))
+
+
+def bench_instrument(size=8, n_playout=800, n_positions=4):
+    """
+    搜索统计：各阶段耗时占比，以及打开统计后的额外开销
+    """
+    net = load_policy_value_net(size)
+    boards = random_openings(size, n_positions)
+    # 交替测两轮，减小机器负载波动的影响
+    for instrument in (False, True, False, True):
+        mcts = MCTS(net.policy_value_fn, 5, n_playout, True, instrument=instrument)
+        speeds = []
+        for board in boards:
+            mcts.update_with_move(-1)
+            mcts.get_move_probs(copy.deepcopy(board))
+            speeds.append(mcts.playouts_per_second)
+        print("instrument={}: {:.0f} playouts/s".format(instrument, np.mean(speeds)))
+    print(mcts.stats_total)
+
+
+def bench_playout_path(size=15, n_playout=3000, n_positions=3):
+    """
+    逐个模拟的热路径：新旧实现在相同局面上得到逐位相同的树，以及每次模拟的开销（不含网络）
+    """
+    for policy, name in ((fake_policy_value_fn, "fake"), (load_policy_value_net(8).policy_value_fn, "net 8x8")):
+        board_size, budget = (size, n_playout) if name == "fake" else (8, 300)
+        for board in random_openings(board_size, n_positions):
+            old, new = MCTS(policy, 5, budget, True), MCTS(policy, 5, budget, True)
+            for _ in range(budget):
+                legacy_playout(old, board)
+            new.get_move_probs(board)
+            assert tree_signature(old._root) == tree_signature(new._root)
+        print("{}: trees identical".format(name))
+
+    board = random_openings(size, 1)[0]
+    for name, playout in (("legacy", legacy_playout), ("current", MCTS._playout)):
+        mcts = MCTS(fake_policy_value_fn, 5, n_playout, True)
+        for _ in range(n_playout):
+            playout(mcts, board)
+        # 树已建好，再测一轮，只比较选择和回传的开销
+        start = timeit.default_timer()
+        for _ in range(n_playout):
+            playout(mcts, board)
+        elapsed = timeit.default_timer() - start
+        print("{:8s} {:6.1f} us/playout".format(name, elapsed / n_playout * 1e6))
+
+
+def legacy_policy_value_fn(policy_value_net, board: Board):
+    """
+    旧版PolicyValueNet.policy_value_fn的CPU路径：reshape后再.float()，不关梯度，返回0维张量的价值，用于对照
+    """
+    import torch
+    legal = board.legal_moves
+    states = torch.from_numpy(board.current_state().reshape((-1, 4, board.width, board.height))).float()
+    log_act_probs, value = policy_value_net.policy_value_net(states)
+    act_probs = np.exp(log_act_probs.data.numpy().flatten())
+    return zip(legal, act_probs[legal]), value.data[0][0]
+
+
+def bench_inference(size=15, number=500, n_playout=400, thread_counts=(None, 1)):
+    """
+    单个局面的网络评估延迟：旧的调用方式与inference_mode下的policy_value_fn，以及不同的算子内线程数
+    """
+    import torch
+    from gobang.backend import policy_value_net_pytorch
+    model_file = os.path.join(RESOURCES, "current_policy{0}x{0}.model".format(size))
+    board = random_board(size, size)
+    default_threads = torch.get_num_threads()
+    for num_threads in thread_counts:
+        net = policy_value_net_pytorch.PolicyValueNet(size, size, model_file, num_threads=num_threads)
+        legacy_probs, legacy_value = legacy_policy_value_fn(net, board)
+        probs, value = net.policy_value_fn(board)
+        assert np.allclose([p for _, p in legacy_probs], [p for _, p in probs]) and abs(legacy_value - value) < 1e-6
+        for name, fn in (("legacy", functools.partial(legacy_policy_value_fn, net)),
+                         ("policy_value_fn", net.policy_value_fn)):
+            # 落子概率要全部取出来，与MCTS的用法一致
+            elapsed = timeit.timeit(lambda: list(fn(board)[0]), number=number)
+            mcts = MCTS(fn, 5, n_playout, True)
+            mcts.get_move_probs(copy.deepcopy(board))
+            print("{}x{}, threads={}: {:16s} {:7.1f} us/call, MCTS {:.0f} playouts/s".format(
+                size, size, num_threads or torch.get_num_threads(), name, elapsed / number * 1e6,
+                mcts.playouts_per_second))
+        torch.set_num_threads(default_threads)
+
+
+def bench_backends(size=15, batch_sizes=(1, 2, 4, 8, 16, 32, 64), number=50):
+    """
+    推理后端：导出TorchScript、ONNX后与eager模型对照输出，并比较批大小1~64的延迟
+    """
+    import tempfile
+    from gobang.backend import export_model
+    from gobang.backend.inference_backend import load_backend
+    net = load_policy_value_net(size)
+    backends = {"eager": None}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name, export, extension in (("torchscript", export_model.export_torchscript, ".pt"),
+                                        ("onnx", export_model.export_onnx, ".onnx")):
+            path = os.path.join(out_dir, "model" + extension)
+            try:
+                export(net, path)
+                backends[name] = load_backend(path)
+            except ImportError as e:
+                print("{}: skipped ({})".format(name, e))
+                continue
+            print("{}: max abs error {:.2e}".format(name, export_model.check_parity(net, backends[name])))
+
+    board = random_board(size, size)
+    states = np.stack([board.current_state()] * max(batch_sizes))
+    print("batch " + "".join("{:>12s}".format(name) for name in backends) + "  (us/position)")
+    for batch_size in batch_sizes:
+        row = []
+        for backend in backends.values():
+            net.backend = backend
+            net.policy_value_states(states[:batch_size])
+            elapsed = timeit.timeit(lambda: net.policy_value_states(states[:batch_size]), number=number)
+            row.append(elapsed / number / batch_size * 1e6)
+        print("{:5d} ".format(batch_size) + "".join("{:12.1f}".format(t) for t in row))
+    net.backend = None
+
+
+_STARTUP_SCRIPT = """
+import resource, time
+start = time.perf_counter()
+def peak_rss_kb():
+    # /proc中的VmHWM不含exec之前父进程的内存；其他系统退回ru_maxrss
+    try:
+        with open("/proc/self/status") as status:
+            return int(next(line for line in status if line.startswith("VmHWM")).split()[1])
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+from gobang.backend.board import Board
+from {module} import {cls}
+net = {cls}({size}, {size}, model_file={model!r})
+list(net.policy_value_fn(Board({size}, {size}))[0])
+print(time.perf_counter() - start, peak_rss_kb())
+"""
+
+
+def bench_numpy_net(size=15, number=300, batch_sizes=(1, 16)):
+    """
+    NumPy推理与torch推理：输出对照，新进程中从导入到完成第一次评估的时间和内存峰值，以及每个局面的延迟
+    """
+    import subprocess
+    import sys
+    from gobang.backend.policy_value_net_numpy import NumpyPolicyValueNet
+    model_file = os.path.join(RESOURCES, "current_policy{0}x{0}.model".format(size))
+    engines = {"torch": load_policy_value_net(size), "numpy": NumpyPolicyValueNet(size, size, model_file)}
+    states = np.stack([random_board(size, n).current_state() for n in range(max(batch_sizes))])
+    (torch_probs, torch_values), (numpy_probs, numpy_values) = (engine.policy_value_states(states)
+                                                                for engine in engines.values())
+    print("max abs error: probs {:.2e}, values {:.2e}".format(np.abs(torch_probs - numpy_probs).max(),
+                                                              np.abs(torch_values - numpy_values).max()))
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for name, module, cls in (("torch", "gobang.backend.policy_value_net_pytorch", "PolicyValueNet"),
+                              ("numpy", "gobang.backend.policy_value_net_numpy", "NumpyPolicyValueNet")):
+        script = _STARTUP_SCRIPT.format(module=module, cls=cls, size=size, model=model_file)
+        start = timeit.default_timer()
+        output = subprocess.run([sys.executable, "-c", script], cwd=root, check=True, capture_output=True,
+                                text=True).stdout.split()
+        wall = timeit.default_timer() - start
+        print("{:6s} startup {:.2f}s (process {:.2f}s), peak RSS {:.0f} MB".format(
+            name, float(output[-2]), wall, int(output[-1]) / 1024))
+
+    board = random_board(size, size)
+    for name, engine in engines.items():
+        latency = timeit.timeit(lambda: list(engine.policy_value_fn(board)[0]), number=number) / number
+        row = ["policy_value_fn {:.0f} us".format(latency * 1e6)]
+        for batch_size in batch_sizes:
+            elapsed = timeit.timeit(lambda: engine.policy_value_states(states[:batch_size]), number=number // 10)
+            row.append("batch {} {:.0f} us/position".format(batch_size, elapsed / (number // 10) / batch_size * 1e6))
+        print("{:6s} {}".format(name, ", ".join(row)))
+
+
+def bench_quantization(size=15, n_games=2, n_playout=100, number=300):
+    """
+    INT8量化：自我对弈局面上与float模型的策略KL散度、评估值误差，以及PolicyValueNet中单个局面的延迟
+    """
+    import tempfile
+    from gobang.backend import policy_value_net_pytorch, quantization
+    model_file = os.path.join(RESOURCES, "current_policy{0}x{0}.model".format(size))
+    net = load_policy_value_net(size)
+    calibration = quantization.self_play_states(net.policy_value_fn, size, size, n_games, n_playout, seed=0)
+    evaluation = quantization.self_play_states(net.policy_value_fn, size, size, 1, n_playout, seed=1)
+    board = random_board(size, size)
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, "model_int8_static.pt")
+        quantization.save_quantized(quantization.quantize_static(net.policy_value_net, calibration), path)
+        for name, quantize in (("float", None), ("dynamic", "dynamic"), ("static", path)):
+            quantized = net if quantize is None else policy_value_net_pytorch.PolicyValueNet(
+                size, size, model_file, device="cpu", quantize=quantize)
+            report = quantization.compare(net.policy_value_net, quantized.backend or quantized.policy_value_net,
+                                          evaluation)
+            elapsed = timeit.timeit(lambda: list(quantized.policy_value_fn(board)[0]), number=number) / number
+            print("{:8s} policy_value_fn {:5.0f} us, KL mean {:.2e} max {:.2e}, value error mean {:.2e} max {:.2e}"
+                  .format(name, elapsed * 1e6, report["kl_mean"], report["kl_max"],
+                          report["value_error_mean"], report["value_error_max"]))
+
+
+def bench_policy_value_batch(size=15, batch_sizes=(1, 8, 32, 128), number=20):
+    """
+    policy_value_batch：与逐个调用policy_value_fn的结果对照，并比较评估N个棋盘的耗时
+    """
+    from gobang.backend.policy_value_net_numpy import NumpyPolicyValueNet
+    net = load_policy_value_net(size)
+    numpy_net = NumpyPolicyValueNet(size, size, os.path.join(RESOURCES, "current_policy{0}x{0}.model".format(size)))
+    boards = [random_board(size, n % (size * size // 2)) for n in range(max(batch_sizes))]
+    for name, engine in (("torch", net), ("numpy", numpy_net)):
+        act_probs, values = engine.policy_value_batch(boards)
+        for board, probs, value in zip(boards, act_probs, values):
+            acts, expected = zip(*engine.policy_value_fn(board)[0])
+            assert np.count_nonzero(probs) <= len(acts) and np.allclose(probs[list(acts)], expected, atol=1e-6)
+            assert np.isclose(value, engine.policy_value_fn(board)[1], atol=1e-6)
+        print("{}: matches policy_value_fn on {} boards".format(name, len(boards)))
+
+    print("boards   policy_value_fn loop   policy_value_batch  (us/board)")
+    for batch_size in batch_sizes:
+        batch = boards[:batch_size]
+        loop = timeit.timeit(lambda: [list(net.policy_value_fn(board)[0]) for board in batch], number=number)
+        batched = timeit.timeit(lambda: net.policy_value_batch(batch), number=number)
+        print("{:6d} {:22.0f} {:20.0f}".format(batch_size, loop / number / batch_size * 1e6,
+                                               batched / number / batch_size * 1e6))
+
+
+def _search_worker(policy_factory, size, n_playout, n_searches, seed, start, results):
+    """
+    bench_inference_server的工作进程：就绪后等待start，再对n_searches个开局各搜索一次
+    """
+    policy_value_fn = policy_factory()
+    boards = random_openings(size, n_searches, seed=seed)
+    results.put("ready")
+    start.wait()
+    for board in boards:
+        MCTS(policy_value_fn, 5, n_playout, True).get_move_probs(board)
+    results.put(n_searches * n_playout)
+
+
+def _run_search_workers(factories, size, n_playout, n_searches):
+    """
+    每个policy_factory一个工作进程，全部就绪后同时开始
+    :return: 所有工作进程合计的每秒模拟次数
+    """
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    start, results = context.Event(), context.Queue()
+    workers = [context.Process(target=_search_worker, daemon=True,
+                               args=(factory, size, n_playout, n_searches, seed, start, results))
+               for seed, factory in enumerate(factories)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        assert results.get() == "ready"
+    begin = timeit.default_timer()
+    start.set()
+    n_playouts = sum(results.get() for _ in workers)
+    elapsed = timeit.default_timer() - begin
+    for worker in workers:
+        worker.join()
+    return n_playouts / elapsed
+
+
+def bench_inference_server(size=15, client_counts=(1, 2, 4, 8), n_playout=100, n_searches=3, max_own_models=4):
+    """
+    推理服务：工作进程数增加时合计的每秒模拟次数和服务端的平均批大小；
+    与每个工作进程各自加载一份模型对照（每份模型约占几百MB内存，只测到max_own_models个进程）
+    """
+    from gobang.backend.inference_server import InferenceServer
+    from gobang.backend.policy_value_net_pytorch import PolicyValueNet, load_policy_value_fn
+    model_file = os.path.join(RESOURCES, "current_policy{0}x{0}.model".format(size))
+
+    # 客户端与直接调用网络的结果一致
+    net = load_policy_value_net(size)
+    server = InferenceServer(functools.partial(PolicyValueNet, size, size, model_file, device="cpu"), size, size, 1)
+    for n_moves in (0, 7, 40):
+        board = random_board(size, n_moves)
+        act_probs, value = server.client(0)(board)
+        expected_act_probs, expected_value = net.policy_value_fn(board)
+        (acts, probs), (expected_acts, expected_probs) = zip(*act_probs), zip(*expected_act_probs)
+        assert acts == expected_acts and np.allclose(probs, expected_probs, atol=1e-6)
+        assert np.isclose(value, expected_value, atol=1e-6)
+    server.close()
+    print("client matches policy_value_fn")
+
+    print("workers   server playouts/s  mean batch   own model playouts/s")
+    for n_clients in client_counts:
+        server = InferenceServer(functools.partial(PolicyValueNet, size, size, model_file, device="cpu"),
+                                 size, size, n_clients)
+        speed = _run_search_workers([server.client(i).connect for i in range(n_clients)], size, n_playout, n_searches)
+        server.close()
+        own = "{:22.0f}".format(_run_search_workers(
+            [functools.partial(load_policy_value_fn, size, size, model_file, "cpu")] * n_clients,
+            size, n_playout, n_searches)) if n_clients <= max_own_models else "{:>22s}".format("-")
+        print("{:7d} {:19.0f} {:11.1f} {}".format(n_clients, speed, server.mean_batch_size, own))
+
+
+BENCHMARKS = {
+    "current_state": bench_current_state,
+    "mcts_engines": bench_mcts_engines,
+    "batch_search": bench_batch_search,
+    "threaded_search": bench_threaded_search,
+    "transposition": bench_transposition,
+    "eval_cache": bench_eval_cache,
+    "tree_memory": bench_tree_memory,
+    "expansion": bench_expansion,
+    "instrument": bench_instrument,
+    "playout_path": bench_playout_path,
+    "inference": bench_inference,
+    "backends": bench_backends,
+    "numpy_net": bench_numpy_net,
+    "quantization": bench_quantization,
+    "policy_value_batch": bench_policy_value_batch,
+    "inference_server": bench_inference_server,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help="可选：{}，默认全部".format(", ".join(BENCHMARKS)))
+    args = parser.parse_args()
+    for name in args.names or list(BENCHMARKS):
+        print("==", name)
+        BENCHMARKS[name]()
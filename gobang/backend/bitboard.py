@@ -0,0 +1,154 @@
+from gobang.backend.board import Board
+
+
+class _BitTables:
+    """
+    某个棋盘尺寸下的位编号与线段掩码，同尺寸的棋盘共用一份，深拷贝棋盘时不复制
+    位编号：h * (width + 1) + w，每行末尾多留一位哨兵（恒为0），避免移位时跨行
+    """
+    _cache = {}
+
+    def __init__(self, width, height, n):
+        self.size = (width, height, n)
+        self.stride = width + 1
+        # 四个方向：水平，竖直，主对角线，副对角线，对应的移位量
+        self.shifts = (1, self.stride, self.stride + 1, self.stride - 1)
+        self.bits = [1 << (move // width * self.stride + move % width) for move in range(width * height)]
+        self.line_masks = [self._make_line_masks(move, width, height, n) for move in range(width * height)]
+
+    @classmethod
+    def get(cls, width, height, n):
+        key = (width, height, n)
+        if key not in cls._cache:
+            cls._cache[key] = cls(width, height, n)
+        return cls._cache[key]
+
+    def _make_line_masks(self, move, width, height, n):
+        """
+        预先计算经过move的四条线段掩码，每条线段以move为中心，两侧各n-1个位置
+        :return: Tuple[(移位量, 掩码)] * 4
+        """
+        h, w = move // width, move % width
+        masks = []
+        for shift, (dh, dw) in zip(self.shifts, ((0, 1), (1, 0), (1, 1), (1, -1))):
+            mask = 0
+            for k in range(-(n - 1), n):
+                i, j = h + k * dh, w + k * dw
+                if 0 <= i < height and 0 <= j < width:
+                    mask |= 1 << (i * self.stride + j)
+            masks.append((shift, mask))
+        return tuple(masks)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return _BitTables.get, self.size
+
+
+class BitBoard(Board):
+    """
+    位棋盘，每个玩家的棋子保存为一个Python整数（位图），接口与Board一致
+    """
+
+    def __init__(self, width=12, height=12, n_in_row=5, start_player=1):
+        """
+        :param width: 宽
+        :param height: 高
+        :param n_in_row: 该参数表示n个棋子连成一线可以获胜
+        """
+        self._tables = _BitTables.get(width, height, n_in_row)
+        self.bitboards = {1: 0, 2: 0}
+        self._winner_stack = []
+        super(BitBoard, self).__init__(width, height, n_in_row, start_player)
+
+    def init_board(self, start_player=1):
+        super(BitBoard, self).init_board(start_player)
+        self.bitboards = {1: 0, 2: 0}
+        self.winner = -1
+        self._winner_stack = []
+
+    def do_move(self, move):
+        """
+        落子，并且只在最后一步周围判断是否连成n子，结果缓存在winner中
+        :param move: 落子位置
+        """
+        player = self.current_player
+        super(BitBoard, self).do_move(move)
+        bitboard = self.bitboards[player] | self._tables.bits[move]
+        self.bitboards[player] = bitboard
+        self._winner_stack.append(self.winner)
+        if self.winner == -1 and self._has_line_through(bitboard, move):
+            self.winner = player
+
+    def undo_move(self):
+        """
+        悔棋，同时清除位图上的棋子，恢复缓存的胜者
+        """
+        move = self.last_move
+        player = self.states[move]
+        super(BitBoard, self).undo_move()
+        self.bitboards[player] &= ~self._tables.bits[move]
+        self.winner = self._winner_stack.pop()
+
+    def _has_line_through(self, bitboard, move):
+        """
+        经过move的四个方向上，是否有n子连成一线
+        """
+        n = self.n_in_row
+        for shift, mask in self._tables.line_masks[move]:
+            line = bitboard & mask
+            run = line
+            for k in range(1, n):
+                run &= line >> (k * shift)
+                if not run:
+                    break
+            if run:
+                return True
+        return False
+
+    def _has_line(self, bitboard):
+        """
+        整个棋盘上是否有n子连成一线，依赖每行末尾的哨兵位
+        """
+        n = self.n_in_row
+        for shift in self._tables.shifts:
+            run = bitboard
+            for k in range(1, n):
+                run &= bitboard >> (k * shift)
+                if not run:
+                    break
+            if run:
+                return True
+        return False
+
+    def judge_with_last_move(self):
+        """
+        根据最后落子快速判断输赢，do_move时已经算好
+        :return: Tuple(是否有赢家 True/False，赢家是谁 1,2, -1)
+        """
+        return self.winner != -1, self.winner
+
+    def has_a_winner(self):
+        """
+        判断是否有赢家，对两个玩家的位图做整盘的移位与运算
+        :return: Tuple(是否有赢家 True/False，赢家是谁 1,2, -1)
+        """
+        for player in self.players:
+            if self._has_line(self.bitboards[player]):
+                return True, player
+        return False, -1
+
+    def game_end(self, fast_judge=False):
+        """
+        判断该棋盘上局面是否结束，若结束且非平局，返回胜者
+        无论是否fast_judge，都直接使用do_move时缓存的结果
+        :return: 是否结束，胜利者；
+        """
+        if self.winner != -1:
+            return True, self.winner
+        elif not self._n_legal:
+            return True, -1
+        else:
+            return False, -1
+
@@ -1,6 +1,68 @@
 import numpy as np
 
 
+def symmetry_maps(width, height) -> np.ndarray:
+    """
+    棋盘的对称变换（旋转、翻转，与TrainPipeline.get_equi_data一致），正方形棋盘8种，否则4种
+    :return: shape(n_symmetry, width * height)，maps[s][move]为move经第s种变换后的位置，第0种为恒等变换
+    """
+    grid = np.arange(width * height).reshape(height, width)
+    if width == height:
+        transformed = [np.rot90(grid, i) for i in range(4)] + [np.fliplr(np.rot90(grid, i)) for i in range(4)]
+    else:
+        transformed = [grid, np.rot90(grid, 2), np.fliplr(grid), np.flipud(grid)]
+    maps = np.empty((len(transformed), width * height), dtype=np.int64)
+    for s, t in enumerate(transformed):
+        # t[i, j] 为落到(i, j)处的原位置，取逆得到原位置变换后落在哪
+        maps[s][t.reshape(-1)] = np.arange(width * height)
+    return maps
+
+
+class _ZobristTables:
+    """
+    某个棋盘尺寸下的Zobrist随机数，同尺寸的棋盘共用一份，深拷贝棋盘时不复制
+    每种对称变换下的64位哈希拼成一个大整数，第s种占第s个64位，一次异或即可同时更新全部
+    keys[player - 1][move]：玩家在move落子时要异或的值（已含轮换走子方）
+    """
+    _cache = {}
+    MASK = (1 << 64) - 1
+
+    def __init__(self, width, height, seed=20210513):
+        self.width, self.height = width, height
+        rng = np.random.RandomState(seed)
+        stone_keys = rng.randint(0, 2 ** 63, size=(2, width * height), dtype=np.int64).tolist()
+        side = int(rng.randint(0, 2 ** 63, dtype=np.int64))  # 轮到玩家2走时异或
+        maps = symmetry_maps(width, height)
+        self.n_symmetry = len(maps)
+        self.side = self.pack([side] * self.n_symmetry)
+        self.keys = [[self.pack([stone_keys[player][m] ^ side for m in maps[:, move].tolist()])
+                      for move in range(width * height)] for player in range(2)]
+
+    @classmethod
+    def get(cls, width, height):
+        key = (width, height)
+        if key not in cls._cache:
+            cls._cache[key] = cls(width, height)
+        return cls._cache[key]
+
+    @staticmethod
+    def pack(keys):
+        packed = 0
+        for s, key in enumerate(keys):
+            packed |= key << (64 * s)
+        return packed
+
+    def unpack(self, packed):
+        return [(packed >> (64 * s)) & self.MASK for s in range(self.n_symmetry)]
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # 序列化时只传尺寸，反序列化后取本进程缓存的一份（种子固定，各进程的随机数相同）
+        return _ZobristTables.get, (self.width, self.height)
+
+
 class Board:
     """
     棋盘类，提供棋盘的管理
@@ -20,12 +82,34 @@ class Board:
         self.players = [1, 2]  # 1：先手黑棋，2：后手白棋
         self.states = {}  # {走子: 对应玩家(1, 2)}
         self.current_player = 1  # 当前玩家，即当前局面下该走子的玩家，1或2
-        self.available = list(range(self.width * self.height))
+        # 可落子位置：_legal前_n_legal个为空位，_legal_index记录每个位置在_legal中的下标，落子时交换删除
+        self._legal = np.arange(self.width * self.height)
+        self._legal_index = list(range(self.width * self.height))
+        self._n_legal = self.width * self.height
+        self._legal_mask = np.ones(self.width * self.height, dtype=bool)  # True为空位
         self.last_move = -1
+        self.move_stack = []  # [(走子, 走子前在_legal中的下标)]，用于悔棋
+        # 神经网络输入的特征平面，按当前玩家分两份，落子时增量更新，shape(2, 4, height, width)
+        # _planes[p - 1]即玩家p该落子时的输入：[己方棋子，对方棋子，最后一步，是否先手]，行已上下翻转
+        self._planes = np.zeros((2, 4, self.height, self.width), dtype=np.float32)
+        self._planes_flat = self._planes.reshape(-1)
+        # Zobrist哈希，各种对称变换后局面的哈希拼在一起，最低的64位即本局面
+        self._zobrist = _ZobristTables.get(self.width, self.height)
+        self._sym_keys = 0
         self.winner = -1
         self.end = -1
         self.init_board(start_player)
 
+    def __getstate__(self):
+        # _planes_flat是_planes的视图，深拷贝、序列化后会变成独立的数组，不保存，恢复时重建
+        state = dict(self.__dict__)
+        del state["_planes_flat"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._planes_flat = self._planes.reshape(-1)
+
     def init_board(self, start_player=1):
         """
         重置棋盘，设定先手，清空落子位置，清空对局记录，清空最后一步
@@ -35,15 +119,98 @@ class Board:
         # 当前玩家设置为初始玩家
         self.current_player = start_player
         # 可落子位置设置为全部位置
-        self.available = list(range(self.width * self.height))
+        self._legal = np.arange(self.width * self.height)
+        self._legal_index = list(range(self.width * self.height))
+        self._n_legal = self.width * self.height
+        self._legal_mask = np.ones(self.width * self.height, dtype=bool)
         # 棋局走子记录设为空
         self.states = {}  # {走子: 对应玩家(1, 2)}
         # 最后一步设为-1，即没有落子
         self.last_move = -1
+        # 清空走子栈
+        self.move_stack = []
+        # 清空特征平面，第四个平面只与谁先手有关，整局不变
+        self._planes[:] = 0.0
+        self._planes[start_player - 1, 3] = 1.0
+        # 空棋盘的哈希只与先手是谁有关
+        self._sym_keys = self._zobrist.side if start_player == 2 else 0
+
+    @property
+    def available(self):
+        """
+        可落子位置，只读视图，顺序不固定
+        :return: np.ndarray
+        """
+        return self.legal_moves
+
+    @property
+    def legal_moves(self):
+        """
+        可落子位置的下标数组（只读视图），可直接用于策略输出的花式索引
+        :return: np.ndarray, shape(n_legal, )
+        """
+        view = self._legal[:self._n_legal]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def legal_mask(self):
+        """
+        可落子位置掩码（只读视图），True为空位
+        :return: np.ndarray, shape(width * height, ), dtype=bool
+        """
+        view = self._legal_mask[:]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def zobrist_key(self):
+        """
+        局面的64位Zobrist哈希（含轮到谁走），落子和悔棋时增量更新
+        :return: int
+        """
+        return self._sym_keys & _ZobristTables.MASK
+
+    def canonical_key(self):
+        """
+        对称不变的局面哈希，旋转、翻转后等价的局面哈希相同
+        :return: int
+        """
+        return min(self._zobrist.unpack(self._sym_keys))
+
+    def canonical_symmetry(self):
+        """
+        :return: Tuple(对称不变的局面哈希，取到该哈希的对称变换下标s)，move经symmetry_maps(...)[s]变换到规范局面
+        """
+        keys = self._zobrist.unpack(self._sym_keys)
+        key = min(keys)
+        return key, keys.index(key)
 
     def reset_board(self):
         self.init_board(self.start_player)
 
+    def _plane_offset(self, move):
+        """
+        落子位置在单个特征平面（已上下翻转）中的下标
+        """
+        return (self.height - 1 - move // self.width) * self.width + move % self.width
+
+    def _update_planes(self, move, player, value):
+        """
+        在特征平面上放置（value=1）或移除（value=0）player的一个棋子
+        """
+        size = self.width * self.height
+        offset = self._plane_offset(move)
+        # 己方视角的第0个平面，对方视角的第1个平面
+        self._planes_flat[(player - 1) * 4 * size + offset] = value
+        self._planes_flat[(2 - player) * 4 * size + size + offset] = value
+
+    def _update_last_move_plane(self, move, value):
+        size = self.width * self.height
+        offset = 2 * size + self._plane_offset(move)
+        self._planes_flat[offset] = value
+        self._planes_flat[4 * size + offset] = value
+
     def move_to_location(self, move):
         return move // self.width, move % self.width
 
@@ -64,15 +231,51 @@ class Board:
         根据落子位置记录一些状态
         :param move: 落子位置
         """
+        # available、legal_moves是NumPy数组，从中取出的np.int64转成int，避免NumPy标量进入states等状态（json无法序列化）
+        move = int(move)
         # 记录落子位置和落子玩家编号
         self.states[move] = self.current_player
-        # 可落子位置中移除该位置
-        self.available.remove(move)
+        # 更新特征平面和哈希
+        self._update_planes(move, self.current_player, 1.0)
+        self._sym_keys ^= self._zobrist.keys[self.current_player - 1][move]
+        if self.last_move != -1:
+            self._update_last_move_plane(self.last_move, 0.0)
+        self._update_last_move_plane(move, 1.0)
+        # 可落子位置中移除该位置：与末尾的空位交换后长度减一，记下原下标，悔棋时换回原处
+        legal, n = self._legal, self._n_legal - 1
+        index = self._legal_index[move]
+        last = int(legal[n])
+        legal[index], self._legal_index[last] = last, index
+        legal[n], self._legal_index[move] = move, n
+        self._n_legal = n
+        self._legal_mask[move] = False
+        self.move_stack.append((move, index))
         # 改变当前玩家
         self.current_player = self.players[0] if self.current_player == self.players[1] else self.players[1]
         # 记录最后一个落子位置
         self.last_move = move
 
+    def undo_move(self):
+        """
+        悔棋，撤销最后一步落子，恢复当前玩家、最后一步和可落子位置
+        """
+        move, index = self.move_stack.pop()
+        player = self.states.pop(move)
+        self._update_planes(move, player, 0.0)
+        self._sym_keys ^= self._zobrist.keys[player - 1][move]
+        self._update_last_move_plane(move, 0.0)
+        if self.move_stack:
+            self._update_last_move_plane(self.move_stack[-1][0], 1.0)
+        # 落子时的逆操作：长度加一，再与原下标处的空位换回来
+        legal, n = self._legal, self._n_legal
+        other = int(legal[index])
+        legal[index], self._legal_index[move] = move, index
+        legal[n], self._legal_index[other] = other, n
+        self._n_legal = n + 1
+        self._legal_mask[move] = True
+        self.current_player = self.players[0] if self.current_player == self.players[1] else self.players[1]
+        self.last_move = self.move_stack[-1][0] if self.move_stack else -1
+
     def get_current_player(self):
         """
         返回当前该落子的玩家
@@ -80,30 +283,20 @@ class Board:
         """
         return self.current_player
 
-    def current_state(self, feat_nums=4) -> np.ndarray:
+    def current_state(self, feat_nums=4, out=None) -> np.ndarray:
         """
         返回局面，矩阵表示，用于神经网络输入
+        特征平面在落子和悔棋时已增量维护好，这里只复制一份连续的float32数组
+        平面依次为：当前玩家的棋子，对方的棋子，最后一步，当前玩家是否先手
+        行是上下翻转的，翻转之后左下角就是0，0了
         :param feat_nums: 二值特征平面个数
+        :param out: 不为None时写入这个shape(feat_nums, height, width)的数组（如批量输入中的一行），不再分配新数组
         :return: shape(feat_nums, height, width)
         """
-        square_state = np.zeros((feat_nums, self.width, self.height))
-        if self.states:
-            moves, players = np.array(list(zip(*self.states.items())))
-            move_curr = moves[players == self.current_player]
-            move_oppo = moves[players != self.current_player]
-            square_state[0][move_curr // self.width, move_curr % self.width] = 1.0
-            # 等价写法
-            # h, w = self.move_to_location(moves[...])
-            # square_state[0][h, w] = 1.0
-            square_state[1][move_oppo // self.width, move_oppo % self.width] = 1.0
-            # 第三个平面，只置了一个1
-            square_state[2][self.last_move // self.width, self.last_move % self.width] = 1.0
-        if len(self.states) % 2 == 0:
-            # state长为偶数，即当前双方都已走完子，当前的player应该为先手玩家，置1
-            square_state[3][:, :] = 1.0
-        # 疑问1 为什么要倒序
-        # 答：把每个棋局上下翻转了一下，不知道为什么，翻转之后左下角就是0，0了
-        return square_state[:, ::-1, :]
+        if out is not None:
+            np.copyto(out, self._planes[self.current_player - 1, :feat_nums])
+            return out
+        return self._planes[self.current_player - 1, :feat_nums].copy()
 
     def judge_with_last_move(self):
         """
@@ -115,13 +308,12 @@ class Board:
         states = self.states
         n = self.n_in_row
 
-        moved = list(set(range(width * height)) - set(self.available))
         # 双方博弈，最少也有 n 个棋子 + 另外两个，一方才够5子
         # 疑问2
-        if len(moved) < self.n_in_row + 2:
+        if len(states) < self.n_in_row + 2:
             return False, -1
 
-        move = moved[-1]
+        move = self.last_move
         h, w = move // width, move % width
         player = states[move]
         # 水平方向n子连成一线，则落子位置到落子位置水平+n, 这n个位置里，对应的玩家应该只有一个值，即len==1，不是0即为1，
@@ -153,9 +345,8 @@ class Board:
         states = self.states
         n = self.n_in_row
 
-        # 落子状况
-        # 所有位置 - 可获得位置（空位置），就是已落子位置
-        moved = list(set(range(width * height)) - set(self.available))
+        # 落子状况，已落子位置
+        moved = list(states)
         # 双方博弈，最少也有 n 个棋子 + 另外两个，一方才够5子
         # 疑问2
         if len(moved) < self.n_in_row + 2:
@@ -196,7 +387,7 @@ class Board:
         if win:
             # 有胜者
             return True, winner
-        elif not len(self.available):
+        elif not self._n_legal:
             # 没有胜者，也没有落子位置，则游戏结束，平局
             return True, -1
         else:
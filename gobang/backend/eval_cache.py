@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from gobang.backend.board import Board, symmetry_maps
+
+
+class EvaluationCache:
+    """
+    策略价值函数前的LRU缓存，接口与policy_value_fn相同，可以直接传给MCTS、MCTSPlayer
+    以对称不变的局面哈希（和变换后的最后一步，它也是网络的输入）为键，旋转、翻转后等价的局面共用一次网络评估；
+    落子概率按规范局面的坐标保存，取出时再经对应的对称变换映射回当前局面
+    网络参数更新后要调用clear()，否则会取到旧网络的结果
+    """
+
+    def __init__(self, policy_value_fn, capacity=100000):
+        """
+        :param policy_value_fn: 被缓存的策略价值函数
+        :param capacity: 最多缓存的局面数，超出后淘汰最久未用到的局面
+        """
+        self._policy = policy_value_fn
+        self.capacity = capacity
+        self._table = OrderedDict()  # {(局面哈希, 最后一步): (规范坐标下的落子概率, 局面评估值)}
+        self._maps = {}  # {(宽, 高): symmetry_maps}
+        self._lock = threading.Lock()  # 多线程搜索时共用
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, board: Board):
+        """
+        :param board: 棋盘局面
+        :return: Tuple(可行落子位置及其概率，局面评估值)
+        """
+        size = (board.width, board.height)
+        maps = self._maps.get(size)
+        if maps is None:
+            maps = self._maps[size] = symmetry_maps(board.width, board.height)
+        canonical_key, s = board.canonical_symmetry()
+        to_canonical = maps[s]
+        last_move = board.last_move
+        key = (canonical_key, int(to_canonical[last_move]) if last_move != -1 else -1)
+        legal = board.legal_moves.copy()
+
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is not None:
+                self._table.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            probs, value = entry
+            return zip(legal.tolist(), probs[to_canonical[legal]].tolist()), value
+
+        act_probs, value = self._policy(board)
+        acts, act_probs = zip(*act_probs) if len(legal) else ((), ())
+        value = float(value)
+        probs = np.zeros(board.width * board.height)
+        probs[to_canonical[list(acts)]] = act_probs
+        with self._lock:
+            self.misses += 1
+            self._table[key] = (probs, value)
+            if len(self._table) > self.capacity:
+                self._table.popitem(last=False)
+        return zip(acts, act_probs), value
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        """
+        清空缓存和计数，网络参数更新后调用
+        """
+        with self._lock:
+            self._table.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._table)
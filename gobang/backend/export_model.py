@@ -0,0 +1,75 @@
+"""
+把训练好的模型导出为TorchScript(.pt)和ONNX(.onnx)，并检查导出模型与eager模型的输出一致
+用法：python -m gobang.backend.export_model gobang/resources/current_policy15x15.model --size 15
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from gobang.backend.inference_backend import load_backend
+from gobang.backend.policy_value_net_pytorch import PolicyValueNet
+
+
+def export_torchscript(policy_value_net: PolicyValueNet, path):
+    """
+    用trace导出TorchScript，批大小可变
+    """
+    net = policy_value_net.policy_value_net.cpu().eval()
+    example = torch.zeros(1, 4, policy_value_net.board_height, policy_value_net.board_width)
+    with torch.no_grad():
+        module = torch.jit.trace(net, example)
+    module.save(path)
+    policy_value_net.policy_value_net.to(policy_value_net.device)
+
+
+def export_onnx(policy_value_net: PolicyValueNet, path):
+    """
+    导出ONNX，输入名state，输出名log_act_probs、value，第0维（批大小）可变；需要安装onnx，PyTorch 2.9起还需要onnxscript
+    """
+    net = policy_value_net.policy_value_net.cpu().eval()
+    example = torch.zeros(1, 4, policy_value_net.board_height, policy_value_net.board_width)
+    torch.onnx.export(net, (example,), path, input_names=["state"], output_names=["log_act_probs", "value"],
+                      dynamic_axes={"state": {0: "batch"}, "log_act_probs": {0: "batch"}, "value": {0: "batch"}})
+    policy_value_net.policy_value_net.to(policy_value_net.device)
+
+
+def check_parity(policy_value_net: PolicyValueNet, backend, batch_sizes=(1, 7, 64), atol=1e-4, seed=0):
+    """
+    随机局面上比较后端与eager模型的输出
+    :return: 最大绝对误差
+    """
+    rng = np.random.RandomState(seed)
+    shape = (4, policy_value_net.board_height, policy_value_net.board_width)
+    max_error = 0.0
+    for batch_size in batch_sizes:
+        states = (rng.rand(batch_size, *shape) < 0.3).astype(np.float32)
+        with torch.inference_mode():
+            expected = [out.cpu().numpy() for out in
+                        policy_value_net.policy_value_net(torch.from_numpy(states).to(policy_value_net.device))]
+        for out, ref in zip(backend(states), expected):
+            assert out.shape == ref.shape, (out.shape, ref.shape)
+            max_error = max(max_error, float(np.abs(out - ref).max()))
+    assert max_error <= atol, "导出模型与eager模型的输出不一致，最大误差 {}".format(max_error)
+    return max_error
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_file", help="训练保存的模型，如 gobang/resources/current_policy15x15.model")
+    parser.add_argument("--size", type=int, required=True, help="棋盘大小")
+    parser.add_argument("--out-dir", default=None, help="导出目录，默认与模型同目录")
+    parser.add_argument("--formats", nargs="+", default=["torchscript", "onnx"], help="torchscript, onnx")
+    args = parser.parse_args()
+
+    policy_value_net = PolicyValueNet(args.size, args.size, args.model_file, device="cpu")
+    stem = os.path.splitext(os.path.basename(args.model_file))[0]
+    out_dir = args.out_dir or os.path.dirname(os.path.abspath(args.model_file))
+    exporters = {"torchscript": (export_torchscript, ".pt"), "onnx": (export_onnx, ".onnx")}
+    for name in args.formats:
+        export, extension = exporters[name]
+        path = os.path.join(out_dir, stem + extension)
+        export(policy_value_net, path)
+        error = check_parity(policy_value_net, load_backend(path))
+        print("{}: {}, max abs error {:.2e}".format(name, path, error))
@@ -0,0 +1,64 @@
+"""
+策略价值网络的推理后端：运行导出的TorchScript或ONNX模型（见export_model.py），
+可以传给PolicyValueNet(backend=...)，替代逐层执行Python代码的eager前向计算
+后端都是可调用对象：输入shape(N, 4, height, width)的float32数组，返回(对数落子概率 shape(N, width * height)，局面评估值 shape(N, 1))
+"""
+import numpy as np
+import torch
+
+
+class TorchScriptBackend:
+    """
+    TorchScript模型，加载后冻结参数并做推理优化（算子融合等）
+    """
+
+    def __init__(self, model_file, device="cpu"):
+        """
+        :param model_file: export_model导出的.pt文件
+        :param device: 运行设备
+        """
+        self.device = torch.device(device)
+        module = torch.jit.load(model_file, map_location=self.device).eval()
+        self.module = torch.jit.optimize_for_inference(torch.jit.freeze(module))
+
+    def __call__(self, state_batch: np.ndarray):
+        states = torch.from_numpy(state_batch).to(self.device)
+        with torch.inference_mode():
+            log_act_probs, value = self.module(states)
+        return log_act_probs.cpu().numpy(), value.cpu().numpy()
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime推理，打开全部图优化；需要安装onnxruntime
+    """
+
+    def __init__(self, model_file, num_threads=None):
+        """
+        :param model_file: export_model导出的.onnx文件
+        :param num_threads: 算子内线程数，None即由ONNX Runtime决定
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("OnnxBackend需要onnxruntime：pip install onnxruntime")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, state_batch: np.ndarray):
+        log_act_probs, value = self.session.run(None, {self.input_name: state_batch})
+        return log_act_probs, value
+
+
+def load_backend(model_file, **kwargs):
+    """
+    按扩展名加载推理后端：.onnx用OnnxBackend，其余（.pt）用TorchScriptBackend
+    :param kwargs: 传给后端的其余参数
+    """
+    if model_file.endswith(".onnx"):
+        return OnnxBackend(model_file, **kwargs)
+    return TorchScriptBackend(model_file, **kwargs)
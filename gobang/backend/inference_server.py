@@ -0,0 +1,205 @@
+"""
+本机推理服务：一个子进程加载一份模型，为多个自我对弈、对弈服务的进程评估局面
+客户端把输入平面写入共享内存中自己的槽位，经管道通知服务进程；服务进程把同时到达的请求凑成一批（最多max_batch_size个，
+第一个请求到达后最多再等max_wait_us微秒），一次前向计算后把落子概率、局面评估值写回各槽位并通知客户端
+InferenceClient的接口与policy_value_fn相同，可以直接传给MCTS、MCTSPlayer
+"""
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from gobang.backend.board import Board
+
+
+def _slot_arrays(buffer, n_slots, width, height):
+    """
+    共享内存的布局：输入平面 shape(n_slots, 4, height, width)，落子概率 shape(n_slots, width * height)，
+    局面评估值 shape(n_slots, )，都是float32
+    """
+    n_states, n_probs = n_slots * 4 * width * height, n_slots * width * height
+    states = np.ndarray((n_slots, 4, height, width), dtype=np.float32, buffer=buffer)
+    probs = np.ndarray((n_slots, width * height), dtype=np.float32, buffer=buffer, offset=n_states * 4)
+    values = np.ndarray((n_slots, ), dtype=np.float32, buffer=buffer, offset=(n_states + n_probs) * 4)
+    return states, probs, values
+
+
+def _slot_nbytes(n_slots, width, height):
+    return n_slots * (5 * width * height + 1) * 4
+
+
+def _server_loop(control, conns, net_factory, shm_name, width, height, max_batch_size, max_wait_us):
+    """
+    服务进程：加载一次模型，之后循环收集请求、批量评估，直到控制管道收到close
+    :param control: 与主进程通信的管道
+    :param conns: 各客户端的管道，下标即槽位
+    :param net_factory: 无参可调用对象，返回有policy_value_states方法的网络
+    """
+    net = net_factory()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    states, probs, values = _slot_arrays(shm.buf, len(conns), width, height)
+    slot_of = {conn: slot for slot, conn in enumerate(conns)}
+    open_conns = list(conns)
+    max_wait = max_wait_us * 1e-6
+    n_batches = n_positions = 0
+    control.send("ready")
+
+    def collect(ready, slots):
+        for conn in ready:
+            try:
+                conn.recv_bytes()
+            except EOFError:
+                # 客户端已退出
+                open_conns.remove(conn)
+                continue
+            slots.append(slot_of[conn])
+
+    while True:
+        ready = wait(open_conns + [control])
+        if control in ready:
+            break
+        slots = []
+        collect(ready, slots)
+        # 动态凑批：第一个请求到达后，在max_wait内继续收集，凑满或全部客户端都在等待时立即评估
+        deadline = time.perf_counter() + max_wait
+        while slots and len(slots) < min(max_batch_size, len(open_conns)):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            ready = wait([conn for conn in open_conns if slot_of[conn] not in slots], remaining)
+            if not ready:
+                break
+            collect(ready, slots)
+        if not slots:
+            continue
+        # 超出max_batch_size的请求分成几批
+        for start in range(0, len(slots), max_batch_size):
+            batch = np.array(slots[start:start + max_batch_size])
+            act_probs, value = net.policy_value_states(states[batch])
+            probs[batch] = act_probs
+            values[batch] = value
+            n_batches += 1
+            n_positions += len(batch)
+            for slot in batch:
+                conns[slot].send_bytes(b"\0")
+
+    control.send((n_batches, n_positions))
+    del states, probs, values
+    shm.close()
+
+
+class InferenceClient:
+    """
+    推理服务的客户端，接口与policy_value_fn相同；可序列化，传给子进程后在第一次调用时连接共享内存
+    每个客户端只有一个槽位，同一时刻只能有一个请求，不要在多个线程中同时调用
+    """
+
+    def __init__(self, conn, shm_name, slot, n_slots, width, height):
+        self._conn = conn
+        self._shm_name = shm_name
+        self.slot = slot
+        self._n_slots = n_slots
+        self.width = width
+        self.height = height
+        self._shm = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_shm"] = None
+        for name in ("_states", "_probs", "_values"):
+            state.pop(name, None)
+        return state
+
+    def connect(self):
+        """
+        连接共享内存，返回自身；可作为RootParallelMCTS的policy_factory
+        """
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self._shm_name)
+            states, probs, values = _slot_arrays(self._shm.buf, self._n_slots, self.width, self.height)
+            # 本槽位的视图，评估值取长度1的切片才是视图
+            self._states, self._probs, self._values = states[self.slot], probs[self.slot], values[self.slot:self.slot + 1]
+        return self
+
+    def __call__(self, board: Board):
+        """
+        :param board: 棋盘局面
+        :return: Tuple(可行落子位置及其概率，局面评估值)
+        """
+        self.connect()
+        board.current_state(out=self._states)
+        self._conn.send_bytes(b"\0")
+        self._conn.recv_bytes()
+        availables = board.legal_moves
+        return zip(availables.tolist(), self._probs[availables].tolist()), float(self._values[0])
+
+    def close(self):
+        """
+        断开共享内存和管道，服务进程不再等待这个客户端
+        """
+        if self._shm is not None:
+            del self._states, self._probs, self._values
+            self._shm.close()
+            self._shm = None
+        self._conn.close()
+
+
+class InferenceServer:
+    """
+    本机推理服务，构造时启动服务进程并为n_clients个客户端分配槽位
+    用法：
+        server = InferenceServer(functools.partial(PolicyValueNet, width, height, model_file, device="cpu"),
+                                 width, height, n_clients=4)
+        用server.client(i)作为第i个工作进程的policy_value_fn；全部结束后server.close()
+    """
+
+    def __init__(self, net_factory, width, height, n_clients, max_batch_size=32, max_wait_us=500):
+        """
+        :param net_factory: 可序列化的无参可调用对象，返回有policy_value_states方法的网络，
+            如functools.partial(PolicyValueNet, width, height, model_file)，在服务进程中调用
+        :param n_clients: 客户端个数，每个客户端一个槽位
+        :param max_batch_size: 一次前向计算最多评估的局面数
+        :param max_wait_us: 第一个请求到达后最多再等待的微秒数，等待期间到达的请求并入同一批
+        """
+        self.width = width
+        self.height = height
+        self.n_batches = self.n_positions = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=_slot_nbytes(n_clients, width, height))
+        context = multiprocessing.get_context("spawn")
+        self._control, child_control = context.Pipe()
+        pairs = [context.Pipe() for _ in range(n_clients)]
+        self._clients = [InferenceClient(client_conn, self._shm.name, slot, n_clients, width, height)
+                         for slot, (client_conn, _) in enumerate(pairs)]
+        self._server = context.Process(target=_server_loop, daemon=True,
+                                       args=(child_control, [server_conn for _, server_conn in pairs], net_factory,
+                                             self._shm.name, width, height, max_batch_size, max_wait_us))
+        self._server.start()
+        # 等服务进程加载好模型
+        assert self._control.recv() == "ready"
+
+    def client(self, slot):
+        """
+        :return: 第slot个客户端，传给工作进程，或直接在本进程中使用
+        """
+        return self._clients[slot]
+
+    @property
+    def mean_batch_size(self):
+        return self.n_positions / self.n_batches if self.n_batches else 0.0
+
+    def close(self):
+        """
+        结束服务进程，释放共享内存；n_batches、n_positions记录服务期间的批次数和局面数
+        """
+        if self._server is None:
+            return
+        self._control.send("close")
+        self.n_batches, self.n_positions = self._control.recv()
+        self._server.join()
+        self._server = None
+        for client in self._clients:
+            client.close()
+        self._shm.close()
+        self._shm.unlink()
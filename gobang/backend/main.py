@@ -11,6 +11,7 @@ import json
 sys.path.append(os.path.split(os.path.split(sys.path[0])[0])[0])
 
 import numpy as np
+from gobang.backend.bitboard import BitBoard
 from gobang.backend.board import Board
 from gobang.backend.game import Game
 from gobang.backend.mcts_alphaZero import MCTSPlayer
@@ -19,14 +20,21 @@ from gobang.backend.policy_value_net_pytorch import PolicyValueNet
 
 class TrainPipeline:
 
-    def __init__(self, width=8, height=8, n=300, init_model=None, save_model=None):
+    def __init__(self, width=8, height=8, n=300, init_model=None, save_model=None, use_bitboard=False,
+                 eval_cache_size=0, tactics=False, instrument=False):
         self.save_model_path = save_model
         self.board_width = 8
         self.board_width = width
         self.board_height = 8
         self.board_height = height
         self.n_in_row = 5
-        self.board = Board(width=self.board_width, height=self.board_height, n_in_row=self.n_in_row)
+        # use_bitboard: 使用位棋盘，落子时即判断输赢，MCTS每次模拟都更快
+        # eval_cache_size: 自我对弈时缓存网络评估，每次更新网络后清空
+        # tactics: 自我对弈时先检查一步成五和必须封堵的位置，有则直接落子
+        # instrument: 记录MCTS的搜索统计，每局自我对弈后打印
+        self.instrument = instrument
+        board_class = BitBoard if use_bitboard else Board
+        self.board = board_class(width=self.board_width, height=self.board_height, n_in_row=self.n_in_row)
         self.game = Game(self.board)
         # 自我博弈参数
         self.temperature = 1
@@ -47,7 +55,8 @@ class TrainPipeline:
             # 随机初始化网络
             self.policy_value_net = PolicyValueNet(self.board_width, self.board_height)
         self.mcts_player = MCTSPlayer(self.policy_value_net.policy_value_fn, self.c_puct, self.n_playout,
-                                      is_self_play=1)
+                                      is_self_play=1, undo_search=True, eval_cache_size=eval_cache_size,
+                                      tactics=tactics, instrument=instrument)
         self.train_process = []
 
     def get_equi_data(self, playdata: List[Tuple[np.ndarray, np.ndarray, int]]):
@@ -96,6 +105,9 @@ class TrainPipeline:
             winner_batch,
             self.learn_rate
         )
+        if self.mcts_player.eval_cache is not None:
+            # 网络已更新，缓存的评估结果作废
+            self.mcts_player.eval_cache.clear()
         return loss, entropy
 
     def run(self):
@@ -110,6 +122,9 @@ class TrainPipeline:
                 # get action一次0.5s
                 start = time.perf_counter()
                 episode_len, winner = self.collect_selfplay_data()  # 疑问：这是什么用的
+                if self.instrument:
+                    print("search: {}".format(self.mcts_player.mcts.stats_total))
+                    self.mcts_player.mcts.reset_stats()
                 loss, entropy = 0, 0
                 if len(self.data_buffer) > self.batch_size:
                     loss, entropy = self.policy_update()
@@ -1,10 +1,17 @@
 import copy
+import sys
+from array import array
+import threading
+import time
 from typing import Dict
 
 import numpy as np
 
 from gobang.backend.board import Board
+from gobang.backend.eval_cache import EvaluationCache
 from gobang.backend.player import PlayerBase
+from gobang.backend.tactics import forced_move
+from gobang.utils.stoppable_thread import StoppableThread
 
 
 def softmax(x):
@@ -15,8 +22,9 @@ def softmax(x):
 
 class TreeNode:
     """
-    蒙特卡洛搜索树节点
+    蒙特卡洛搜索树节点，用__slots__省去每个结点的__dict__
     """
+    __slots__ = ("parent", "children", "n_visits", "_Q", "_P", "_U", "_n_virtual", "_pending")
 
     def __init__(self, parent, prior_p):
         """
@@ -30,27 +38,56 @@ class TreeNode:
         self._Q = 0  # Q值
         self._P = prior_p
         self._U = 0
+        self._n_virtual = 0  # 虚拟损失：正在等待评估的模拟经过该结点的次数，每次视为一次失败
+        # 只展开了一部分时不为None；渐进展开时为尚未建立子结点的[动作数组, 先验概率数组]，按先验概率从小到大
+        self._pending = None
 
     def select(self, c_puct):
         """
-        在子结点中选择U+Q最大的子节点并返回
+        在子结点中选择U+Q最大的子节点并返回，U+Q相同时取先遍历到的
+        sqrt(N)每个父结点只算一次，不经过get_value，也不再写入_U
         :param c_puct:
         :return: Tuple(被选择的动作，执行该动作后跳转的结点)
         """
-        return max(self.children.items(), key=lambda act_node: act_node[1].get_value(c_puct))
+        sqrt_n = np.sqrt(self.n_visits)
+        best_value, best = -float("inf"), None
+        for act_node in self.children.items():
+            child = act_node[1]
+            if child._n_virtual or self._n_virtual:
+                value = child._get_value_with_virtual_loss(c_puct)
+            else:
+                # 运算顺序与get_value相同，结果逐位一致
+                value = child._Q + c_puct * child._P * sqrt_n / (1 + child.n_visits)
+            if value > best_value:
+                best_value, best = value, act_node
+        return best
 
     def get_value(self, c_puct):
+        if self._n_virtual or self.parent._n_virtual:
+            return self._get_value_with_virtual_loss(c_puct)
         self._U = (c_puct * self._P * np.sqrt(self.parent.n_visits) / (1 + self.n_visits))
         return self._Q + self._U
 
+    def _get_value_with_virtual_loss(self, c_puct):
+        """
+        计入虚拟损失后的Q+U，批量搜索时让同一批的多条路径分散开
+        """
+        n_visits = self.n_visits + self._n_virtual
+        self._U = (c_puct * self._P * np.sqrt(self.parent.n_visits + self.parent._n_virtual) / (1 + n_visits))
+        q = (self._Q * self.n_visits - self._n_virtual) / n_visits if n_visits else self._Q
+        return q + self._U
+
     def expand(self, actions_priors):
         """
         扩展self结点
         :param actions_priors: self结点下的可行动作和其对应的先验概率 列表
+        :return: 新建的子结点数
         """
+        n_children = len(self.children)
         for action, prior in actions_priors:
             if action not in self.children:
                 self.children[action] = TreeNode(parent=self, prior_p=prior)
+        return len(self.children) - n_children
 
     def update(self, leaf_value):
         """
@@ -80,66 +117,572 @@ class TreeNode:
         return self.parent is None
 
 
+def terminal_value(board: Board, winner):
+    """
+    终局的叶结点值，从轮到走的一方看：平局为0，胜者是轮到走的一方为1，否则为-1
+    :param winner: game_end返回的胜者，-1为平局
+    """
+    if winner == -1:
+        return 0.0
+    return 1.0 if winner == board.get_current_player() else -1.0
+
+
+def _no_clock():
+    """
+    不记录统计时代替time.perf_counter，_playout中的计时点都变成空操作
+    """
+    return 0.0
+
+
+class SearchStats:
+    """
+    一次（或累计多次）搜索的统计：各阶段耗时、搜索深度、树的大小和根节点的访问分布
+    """
+    PHASES = ("select", "copy", "move", "evaluate", "game_end", "backup")
+
+    def __init__(self):
+        self.n_searches = 0
+        self.n_playouts = 0
+        self.elapsed = 0.0  # 搜索总耗时（秒）
+        self.time = dict.fromkeys(self.PHASES, 0.0)  # {阶段: 耗时（秒）}，move含悔棋，backup含扩展
+        self.max_depth = 0
+        self.total_depth = 0
+        self.tree_size = 0  # 最近一次搜索结束时的结点数
+        self.root_visits = {}  # 最近一次搜索结束时 {根节点下的动作: 访问次数}
+
+    @property
+    def playouts_per_second(self):
+        return self.n_playouts / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def mean_depth(self):
+        return self.total_depth / self.n_playouts if self.n_playouts else 0.0
+
+    def add_depth(self, depth):
+        """
+        记录一次模拟的搜索深度
+        """
+        self.total_depth += depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def merge(self, other):
+        """
+        累加另一次搜索的统计
+        :param other: SearchStats
+        """
+        self.n_searches += other.n_searches
+        self.n_playouts += other.n_playouts
+        self.elapsed += other.elapsed
+        for phase in self.PHASES:
+            self.time[phase] += other.time[phase]
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.total_depth += other.total_depth
+        self.tree_size = other.tree_size
+        self.root_visits = other.root_visits
+
+    def as_dict(self):
+        return {"n_searches": self.n_searches, "n_playouts": self.n_playouts, "elapsed": self.elapsed,
+                "playouts_per_second": self.playouts_per_second, "time": dict(self.time),
+                "max_depth": self.max_depth, "mean_depth": self.mean_depth, "tree_size": self.tree_size,
+                "root_visits": dict(self.root_visits)}
+
+    def __str__(self):
+        phases = ", ".join("{} {:.1%}".format(phase, self.time[phase] / self.elapsed if self.elapsed else 0.0)
+                           for phase in self.PHASES)
+        return "{} playouts in {:.2f}s ({:.0f}/s), depth mean {:.1f} max {}, tree size {}; {}".format(
+            self.n_playouts, self.elapsed, self.playouts_per_second, self.mean_depth, self.max_depth,
+            self.tree_size, phases)
+
+
 class MCTS():
     """
     蒙特卡洛树搜索算法的实现
     """
 
-    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000):
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000, undo_search=False, batch_size=1,
+                 policy_value_batch_fn=None, virtual_loss=3, n_threads=1, root_noise_alpha=None, root_noise_eps=0.25,
+                 max_nodes=None, prune_ratio=0.75, expand_top_k=None, expand_prior_mass=None, widen_exponent=None,
+                 instrument=False):
         """
         :param policy_value_fn: 策略价值网络中的方法
         :param c_puct: MCTS执行过程中探索的程度
         :param n_playout: MCTS循环执行的次数
+        :param undo_search: 为True时不再深拷贝棋盘，每次模拟在原棋盘上落子，回传后悔棋复原
+        :param batch_size: 大于1时批量搜索，每轮选出batch_size个叶结点，一次前向计算全部评估后再扩展、回传
+        :param policy_value_batch_fn: 批量评估函数，输入shape(N, 4, height, width)的局面，
+            返回(shape(N, width * height)的落子概率, shape(N, )的局面评估值)，如PolicyValueNet.policy_value_states；
+            为None时仍逐个调用policy_value_fn
+        :param virtual_loss: 批量搜索、多线程搜索时，每条路径在评估前给经过的结点加上的虚拟损失
+        :param n_threads: 大于1时多线程共享一棵树搜索，树的读写加锁，网络评估在锁外并行
+        :param root_noise_alpha: 不为None时，每次搜索前给根节点的先验概率混入Dirichlet(alpha)噪声
+        :param root_noise_eps: 噪声所占的比例
+        :param max_nodes: 搜索树的结点数上限，超出时剪掉访问次数最少的子树，直到不超过max_nodes * prune_ratio；None即不限
+        :param prune_ratio: 剪枝后保留的结点比例
+        :param expand_top_k: 扩展非根结点时只为先验概率最大的k个动作建立子结点；None即全部
+        :param expand_prior_mass: 扩展非根结点时只为先验概率从大到小累计到该比例的动作建立子结点；None即全部
+        :param widen_exponent: 渐进展开，与上面两个参数一起使用：结点访问n次后子结点数上限为
+            (expand_top_k或1) + n ** widen_exponent，被略去的动作按先验概率依次补上；None即不再补
+            换根后只展开了一部分的根节点在搜索前重新完全展开，自我对弈的Dirichlet噪声仍作用于全部可落子位置
+        :param instrument: 记录搜索统计，每次get_move_probs后保存在stats中，累计的保存在stats_total中；
+            各阶段耗时只在逐个模拟（非批量、非多线程）时记录
         """
         self._root = TreeNode(None, 1.0)
         # 疑问：先验概率为什么要1.0
         self._policy = policy_value_fn
         self._c_puct = c_puct
         self._n_playout = n_playout
+        self._undo_search = undo_search
+        self._batch_size = batch_size
+        self._policy_batch = policy_value_batch_fn
+        self._virtual_loss = virtual_loss
+        self._n_threads = n_threads
+        self._root_noise_alpha = root_noise_alpha
+        self._root_noise_eps = root_noise_eps
+        self._max_nodes = max_nodes
+        self._prune_ratio = prune_ratio
+        self._n_nodes = 1  # 搜索树当前的结点数
+        self.n_pruned = 0  # 累计被剪掉的结点数
+        self._expand_top_k = expand_top_k
+        self._expand_prior_mass = expand_prior_mass
+        self._widen_exponent = widen_exponent
+        self._widen_base = expand_top_k or 1
+        self._lock = threading.Lock()
+        self._n_started = 0  # 多线程搜索时已开始的模拟次数
+        self._search_start = 0.0
+        self._deadline = None  # 本次搜索的截止时间
+        self._anytime = False  # 本次搜索是否给了时间限制或模拟次数上限，是则允许提前结束
+        self.check_every = 32  # 每隔多少次模拟检查一次能否提前结束
+        # 最近一次get_move_probs的模拟次数和速度
+        self.n_playouts_done = 0
+        self.playouts_per_second = 0.0
+        self._instrument = instrument
+        self.stats = None  # 最近一次搜索的SearchStats
+        self.stats_total = SearchStats()  # 累计的SearchStats，可调用reset_stats清零
 
-    def _playout(self, state: Board):
+    def _playout(self, state: Board, stats=None):
         """
         从根节点出发，完整的执行MCTS的选择，扩展，评估和回传
         :param state: 根节点（棋盘局面）
+        :param stats: 不为None时（instrument=True）记录各阶段的耗时和搜索深度到该SearchStats
         :return: None
         """
+        # 不记录统计时计时点都是空操作
+        clock = time.perf_counter if stats is not None else _no_clock
+        start = clock()
+        move_time = 0.0
+        c_puct = self._c_puct
+        widen = self._widen_exponent is not None
         node = self._root
-        # 选择，直到叶节点，而不是到棋盘终局
-        while not node.is_leaf():
+        path = [node]
+        # 选择，直到叶节点，而不是到棋盘终局；与TreeNode.select相同，逐个模拟时没有虚拟损失
+        while node.children:
+            if widen and node._pending:
+                # 渐进展开：访问次数够了就补上子结点
+                self._widen(node)
+            sqrt_n = np.sqrt(node.n_visits)
+            best_value = -float("inf")
             # 获取动作（落子位置），以及选择该动作后的棋盘局面（结点）
-            action, node = node.select(self._c_puct)
-            state.do_move(action)
+            for action, child in node.children.items():
+                value = child._Q + c_puct * child._P * sqrt_n / (1 + child.n_visits)
+                if value > best_value:
+                    best_value, best_action, best_child = value, action, child
+            node = best_child
+            t = clock()
+            state.do_move(best_action)
+            move_time += clock() - t
+            path.append(node)
+        t_select = clock()
         # 扩展，局面输入神经网络，返回落子概率和对应的叶节点值，局面评估
         action_priors, leaf_value = self._policy(state)
+        t_evaluate = clock()
+        end, winner = state.game_end()
+        t_game_end = clock()
+        if end:
+            # 终局不扩展，设定leaf_value值
+            action_priors, leaf_value = None, terminal_value(state, winner)
+        self._expand_and_backup(path, action_priors, leaf_value)
+        t_backup = clock()
+        depth = len(path) - 1
+        if self._undo_search:
+            # 沿路径悔棋，棋盘复原到根节点局面
+            for _ in range(depth):
+                state.undo_move()
+        if stats is not None:
+            time_ = stats.time
+            time_["select"] += t_select - start - move_time
+            time_["evaluate"] += t_evaluate - t_select
+            time_["game_end"] += t_game_end - t_evaluate
+            time_["backup"] += t_backup - t_game_end
+            time_["move"] += move_time + clock() - t_backup
+            stats.add_depth(depth)
+
+    def _expand_and_backup(self, path, action_priors, leaf_value):
+        """
+        扩展叶结点（action_priors为None即终局，不扩展），再沿路径回传叶结点值
+        :param path: 从根节点到叶结点的结点列表
+        :param leaf_value: 从叶结点轮到走的一方看的值
+        """
+        if action_priors is not None:
+            self._n_nodes += self._expand_node(path[-1], action_priors)
+        self._backup(path, -leaf_value)
+
+    @staticmethod
+    def _backup(path, leaf_value):
+        """
+        沿路径从叶结点到根节点逐个更新访问次数和Q值，与TreeNode.update_recursively结果相同
+        :param path: 从根节点到叶结点的结点列表
+        :param leaf_value: 叶结点的值，往上每层取反
+        """
+        for node in reversed(path):
+            node.n_visits += 1
+            node._Q += 1.0 * (leaf_value - node._Q) / node.n_visits
+            leaf_value = -leaf_value
+
+    def _playout_batch(self, state: Board, batch_size):
+        """
+        批量模拟：依次选出batch_size条路径，路径上加虚拟损失，使后面的路径避开正在评估的叶结点；
+        然后一次评估全部叶结点，再逐个扩展、回传，撤销虚拟损失
+        :param state: 根节点（棋盘局面）
+        :param batch_size: 本轮的路径数
+        :return: 实际完成的模拟次数，重复选到同一叶结点的路径会被丢弃
+        """
+        paths, leaf_values, pending = [], [], []  # pending: [(路径下标, 可落子位置, 局面)]
+        leaves = set()
+        for _ in range(batch_size):
+            board = state if self._undo_search else copy.deepcopy(state)
+            node = self._root
+            path = [node]
+            while not node.is_leaf():
+                if node._pending and self._widen_exponent is not None:
+                    self._widen(node)
+                action, node = node.select(self._c_puct)
+                board.do_move(action)
+                path.append(node)
+            end, winner = board.game_end()
+            if end:
+                # 终局无需评估
+                leaf_value = (None, terminal_value(board, winner))
+            elif node in leaves:
+                # 与本批前面的路径选到了同一个叶结点，丢弃这条路径
+                leaf_value = None
+            else:
+                leaves.add(node)
+                if self._policy_batch is None:
+                    # 棋盘随后要悔棋，先把落子概率取出来
+                    action_priors, leaf_value = self._policy(board)
+                    leaf_value = (list(action_priors), leaf_value)
+                else:
+                    leaf_value = ()
+                    pending.append((len(paths), board.legal_moves.copy(), board.current_state()))
+            if leaf_value is not None:
+                for n in path:
+                    n._n_virtual += self._virtual_loss
+                paths.append(path)
+                leaf_values.append(leaf_value)
+            if self._undo_search:
+                for _ in range(len(path) - 1):
+                    board.undo_move()
+
+        if pending:
+            act_probs, values = self._policy_batch(np.stack([s for _, _, s in pending]))
+            for (i, legal, _), probs, value in zip(pending, act_probs, values):
+                leaf_values[i] = (zip(legal.tolist(), probs[legal].tolist()), value)
+
+        for path, (action_priors, leaf_value) in zip(paths, leaf_values):
+            for n in path:
+                n._n_virtual -= self._virtual_loss
+            self._expand_and_backup(path, action_priors, leaf_value)
+        return len(paths)
+
+    def _playout_locked(self, state: Board):
+        """
+        多线程搜索中的一次模拟：选择和回传时持有树锁，网络评估时释放，让多个线程的前向计算重叠
+        :param state: 本线程自己的棋盘，模拟结束后悔棋复原
+        """
+        with self._lock:
+            node = self._root
+            path = [node]
+            while not node.is_leaf():
+                if node._pending and self._widen_exponent is not None:
+                    self._widen(node)
+                action, node = node.select(self._c_puct)
+                state.do_move(action)
+                path.append(node)
+            for n in path:
+                n._n_virtual += self._virtual_loss
         end, winner = state.game_end()
         if not end:
-            # 如果还没到终局，则扩展该节点
-            node.expand(action_priors)
+            action_priors, leaf_value = self._policy(state)
+            action_priors = list(action_priors)
+        else:
+            action_priors, leaf_value = None, terminal_value(state, winner)
+        with self._lock:
+            for n in path:
+                n._n_virtual -= self._virtual_loss
+            # 其他线程可能已扩展过该结点，expand会跳过已有的子结点
+            self._expand_and_backup(path, action_priors, leaf_value)
+            if self._max_nodes and self._n_nodes > self._max_nodes:
+                self.prune()
+        for _ in range(len(path) - 1):
+            state.undo_move()
+
+    def _search_worker(self, state: Board, budget):
+        while True:
+            with self._lock:
+                n = self._n_started
+                if n >= budget or (self._deadline is not None and time.perf_counter() >= self._deadline):
+                    return
+                # 与逐个模拟时相同，至少模拟check_every次后才判断能否提前结束；
+                # n为0时按速度估计的剩余次数也是0，复用的根节点已有访问次数时会立即结束
+                if n and n % self.check_every == 0 and self._should_stop(n, budget):
+                    return
+                self._n_started += 1
+            self._playout_locked(state)
+
+    def _search_threaded(self, state: Board, budget):
+        """
+        n_threads个线程共同完成budget次模拟，每个线程使用一份棋盘副本
+        :return: 实际完成的模拟次数
+        """
+        self._n_started = 0
+        threads = [threading.Thread(target=self._search_worker, args=(copy.deepcopy(state), budget))
+                   for _ in range(self._n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._n_started
+
+    def _should_stop(self, n, budget):
+        """
+        是否可以提前结束搜索：已到时间限制，或剩余的模拟次数全给第二名也追不上访问次数最多的动作
+        :param n: 已完成的模拟次数
+        :param budget: 模拟次数上限
+        """
+        if not self._anytime:
+            # 只给了n_playout时照常模拟满，自我对弈的落子概率不受影响
+            return False
+        remaining = budget - n
+        if self._deadline is not None:
+            now = time.perf_counter()
+            if now >= self._deadline:
+                return True
+            # 按目前的速度估计剩余时间内还能模拟几次
+            remaining = min(remaining, n / (now - self._search_start) * (self._deadline - now))
+        acts, visits = self._root_action_visits()
+        if len(visits) < 2:
+            # 还没扩展根节点时不能结束；只有一个可落子位置时不必再搜
+            return len(visits) == 1
+        second, best = np.partition(np.asarray(visits), -2)[-2:]
+        return best - second > remaining
+
+    def _search(self, state: Board, budget):
+        """
+        从根节点执行至多budget次模拟，给了时间限制或模拟次数上限时，超时或结果已确定则提前结束
+        :param state: 棋盘局面
+        :param budget: 模拟次数上限
+        :return: 实际完成的模拟次数
+        """
+        if (self._expand_top_k or self._expand_prior_mass) and self._root._pending is not None:
+            # 换根后的根节点只展开了一部分，重新完全展开
+            action_priors, _ = self._policy(state)
+            self._n_nodes += self._root.expand(action_priors)
+            self._root._pending = None
+        if self._root_noise_alpha:
+            self._add_root_noise(state)
+        if self._n_threads > 1:
+            return self._search_threaded(state, budget)
+        n = 0
+        if self._batch_size > 1:
+            while n < budget:
+                n += self._playout_batch(state, min(self._batch_size, budget - n))
+                if self._max_nodes and self._n_nodes > self._max_nodes:
+                    self.prune()
+                if self._should_stop(n, budget):
+                    break
         else:
-            # 否则，设定leaf_value值
-            if winner == -1:
-                leaf_value = 0.0
+            stats = self.stats if self._instrument else None
+            while n < budget:
+                if stats is None:
+                    state_copy = state if self._undo_search else copy.deepcopy(state)
+                else:
+                    t = time.perf_counter()
+                    state_copy = state if self._undo_search else copy.deepcopy(state)
+                    stats.time["copy"] += time.perf_counter() - t
+                # 更新了self树
+                self._playout(state_copy, stats)
+                n += 1
+                if self._max_nodes and self._n_nodes > self._max_nodes:
+                    self.prune()
+                if self._deadline is not None and time.perf_counter() >= self._deadline:
+                    break
+                if n % self.check_every == 0 and self._should_stop(n, budget):
+                    break
+        return n
+
+    def _expand_node(self, node, action_priors):
+        """
+        按扩展策略扩展结点：根节点完全展开，其余结点按expand_top_k、expand_prior_mass只保留先验概率大的动作
+        :return: 新建的子结点数
+        """
+        if (self._expand_top_k is None and self._expand_prior_mass is None) or node is self._root:
+            return node.expand(action_priors)
+        action_priors = sorted(action_priors, key=lambda action_prior: action_prior[1], reverse=True)
+        k = len(action_priors)
+        if self._expand_top_k is not None:
+            k = min(k, self._expand_top_k)
+        if self._expand_prior_mass is not None and action_priors:
+            mass = np.cumsum([prior for _, prior in action_priors])
+            k = min(k, int(np.searchsorted(mass, self._expand_prior_mass * mass[-1])) + 1)
+        if k < len(action_priors):
+            if self._widen_exponent is not None:
+                rest = action_priors[k:][::-1]
+                node._pending = [array("i", [action for action, _ in rest]), array("d", [prior for _, prior in rest])]
             else:
-                leaf_value = 1.0 if winner == state.get_current_player() else -1.0
-        node.update_recursively(-leaf_value)
+                node._pending = []
+        return node.expand(action_priors[:k])
+
+    def _widen(self, node):
+        """
+        渐进展开：按先验概率从大到小，把尚未建立的子结点补到访问次数对应的上限
+        """
+        limit = self._widen_base + node.n_visits ** self._widen_exponent
+        actions, priors = node._pending
+        children = node.children
+        while actions and len(children) < limit:
+            action, prior = actions.pop(), priors.pop()
+            if action not in children:
+                children[action] = TreeNode(node, prior)
+                self._n_nodes += 1
+        if not actions:
+            node._pending = None
+
+    def prune(self, target=None):
+        """
+        剪枝：按访问次数从少到多，把已扩展的结点变回叶结点（丢掉整棵子树），直到结点数不超过target
+        被剪掉的结点再被选中时会重新扩展；根节点和正在等待评估的路径上的结点不剪
+        :param target: 剪枝后的结点数上限，None即max_nodes * prune_ratio
+        :return: 剪掉的结点数
+        """
+        if target is None:
+            target = int(self._max_nodes * self._prune_ratio)
+        # 计算每棵子树的结点数
+        sizes = {}
+        order = [self._root]
+        for node in order:
+            order.extend(node.children.values())
+        for node in reversed(order):
+            sizes[node] = 1 + sum(sizes[child] for child in node.children.values())
+        n_nodes = sizes[self._root]
+        candidates = sorted((node for node in order[1:] if node.children and not node._n_virtual),
+                            key=lambda node: node.n_visits)
+        removed = set()
+        for node in candidates:
+            if n_nodes <= target:
+                break
+            ancestor = node.parent
+            while ancestor is not None and ancestor not in removed:
+                ancestor = ancestor.parent
+            if ancestor is not None:
+                # 祖先已被剪掉
+                continue
+            size = sizes[node] - 1
+            node.children = {}
+            node._pending = None
+            removed.add(node)
+            n_nodes -= size
+            ancestor = node.parent
+            while ancestor is not None:
+                sizes[ancestor] -= size
+                ancestor = ancestor.parent
+        pruned = self._n_nodes - n_nodes
+        self._n_nodes = n_nodes
+        self.n_pruned += pruned
+        return pruned
 
-    def get_move_probs(self, state: Board, temp=1e-3):
+    def node_count(self):
+        """
+        :return: 搜索树当前的结点数
+        """
+        return self._n_nodes
+
+    def tree_memory(self):
+        """
+        遍历搜索树，统计结点及其children字典占用的内存
+        :return: 字节数
+        """
+        total = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node) + sys.getsizeof(node.children)
+            if node._pending:
+                total += sum(sys.getsizeof(pending) for pending in node._pending)
+            stack.extend(node.children.values())
+        return total
+
+    def _add_root_noise(self, state: Board):
+        """
+        根节点的先验概率混入Dirichlet噪声：P = (1 - eps) * P + eps * Dir(alpha)
+        根节点还没扩展时先用策略价值网络扩展
+        """
+        if self._root.is_leaf():
+            if state.game_end()[0]:
+                return
+            action_priors, _ = self._policy(state)
+            self._n_nodes += self._expand_node(self._root, action_priors)
+        children = list(self._root.children.values())
+        noise = np.random.dirichlet(self._root_noise_alpha * np.ones(len(children)))
+        for child, eta in zip(children, noise):
+            child._P = (1 - self._root_noise_eps) * child._P + self._root_noise_eps * eta
+
+    def get_move_probs(self, state: Board, temp=1e-3, time_limit=None, node_budget=None):
         """
         返回该棋盘状态下，所有可行动作及其对应的概率
+        给了time_limit或node_budget时，访问次数最多的动作已不可能被超过就提前结束，实际的模拟次数记录在n_playouts_done中
         :param state: 棋盘局面
         :param temp: 控制探索程度
+        :param time_limit: 搜索时间上限（秒），None即不限时
+        :param node_budget: 模拟次数上限，None即n_playout
         :return:
         """
-        for n in range(self._n_playout):
-            state_copy = copy.deepcopy(state)
-            # 更新了self树
-            self._playout(state_copy)
+        self._search_start = time.perf_counter()
+        self._deadline = self._search_start + time_limit if time_limit is not None else None
+        self._anytime = time_limit is not None or node_budget is not None
+        if self._instrument:
+            self.stats = SearchStats()
+        n = self._search(state, node_budget or self._n_playout)
+        elapsed = time.perf_counter() - self._search_start
+        self.n_playouts_done = n
+        self.playouts_per_second = n / elapsed if elapsed > 0 else 0.0
 
-        action_visits = [(act, node.n_visits) for act, node in self._root.children.items()]
-        acts, visits = zip(*action_visits)  # 类似转置
+        acts, visits = self._root_action_visits()
+        if self._instrument:
+            stats = self.stats
+            stats.n_searches, stats.n_playouts, stats.elapsed = 1, n, elapsed
+            stats.tree_size = self.node_count()
+            stats.root_visits = dict(zip(acts, (int(v) for v in visits)))
+            self.stats_total.merge(stats)
         act_probs = softmax(1.0 / temp * np.log(np.array(visits) + 1e-10))  # 公式
         return acts, act_probs
 
+    def reset_stats(self):
+        """
+        清零累计的搜索统计
+        """
+        self.stats_total = SearchStats()
+
+    def _root_action_visits(self):
+        """
+        :return: Tuple(根节点下的动作，对应的访问次数)
+        """
+        action_visits = [(act, node.n_visits) for act, node in self._root.children.items()]
+        if not action_visits:
+            return (), ()
+        acts, visits = zip(*action_visits)  # 类似转置
+        return acts, visits
+
     def update_with_move(self, last_move):
         """
         复用搜索子树
@@ -150,9 +693,16 @@ class MCTS():
             # 如果已被扩展，可以复用
             self._root = self._root.children[last_move]
             self._root.parent = None
+            self._n_nodes = 0
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                self._n_nodes += 1
+                stack.extend(node.children.values())
         else:
             # 没被扩展，新建一棵树
             self._root = TreeNode(None, 1.0)
+            self._n_nodes = 1
 
 
 class MCTSPlayer(PlayerBase):
@@ -160,10 +710,93 @@ class MCTSPlayer(PlayerBase):
     AI玩家
     """
 
-    def __init__(self, policy_value_fn=None, c_puct=5, n_playout=2000, is_self_play=0, player=0):
+    def __init__(self, policy_value_fn=None, c_puct=5, n_playout=2000, is_self_play=0, player=0, undo_search=False,
+                 time_limit=None, node_budget=None, reuse_tree=True, ponder=False, ponder_limit=None, ponder_duty=1.0,
+                 eval_cache_size=0, tactics=False, vcf_depth=0, mcts_class=None, **mcts_kwargs):
+        """
+        :param reuse_tree: 人机对弈时保留搜索树，依次用自己和对手的落子换根，复用之前的搜索结果
+        :param ponder: 人机对弈时，在对手思考期间用后台线程继续搜索自己落子后的局面，对手实际的应手下的结果会被复用；需要reuse_tree
+        :param ponder_limit: 每次后台搜索的模拟次数上限，限制搜索树的内存占用，None即n_playout
+        :param ponder_duty: 后台搜索的占空比(0, 1]，每搜索一段就休眠相应的时间，限制CPU占用
+        :param time_limit: 每步搜索的时间上限（秒），None即不限时
+        :param node_budget: 每步的模拟次数上限，None即n_playout；结果已确定时会提前结束
+        :param eval_cache_size: 大于0时在policy_value_fn前加一个该容量的EvaluationCache，保存在eval_cache中
+        :param tactics: 搜索前先检查强制着法（一步成五、封堵对手的成五点），找到则直接落子，不再搜索
+        :param vcf_depth: tactics为True且大于0时，再找至多vcf_depth步的连续冲四取胜
+        :param mcts_class: 搜索算法，默认为MCTS，也可以是ArrayMCTS等MCTS的子类
+        :param mcts_kwargs: 传给mcts_class的其余参数
+        """
         super(MCTSPlayer, self).__init__(player)
-        self.mcts = MCTS(policy_value_fn, c_puct, n_playout)
+        mcts_class = mcts_class or MCTS
+        self.tactics = tactics
+        self.vcf_depth = vcf_depth
+        self.forced = False  # 上一步是否为强制着法
+        self.eval_cache = None
+        if eval_cache_size and policy_value_fn is not None:
+            self.eval_cache = policy_value_fn = EvaluationCache(policy_value_fn, eval_cache_size)
+        self.mcts = mcts_class(policy_value_fn, c_puct, n_playout, undo_search, **mcts_kwargs)
         self.is_self_play = is_self_play
+        self.time_limit = time_limit
+        self.node_budget = node_budget
+        self.reuse_tree = reuse_tree
+        self._last_move = -1  # 上一次自己的落子
+        self._n_stones = -1  # 上一次自己落子前棋盘上的棋子数
+        self.reused_visits = 0  # 本步搜索前，复用的子树根节点下已有的访问次数
+        self.ponder = ponder and reuse_tree
+        self.ponder_limit = ponder_limit or n_playout
+        self.ponder_duty = ponder_duty
+        self.ponder_playouts = 0  # 本次（或上一次）后台搜索已完成的模拟次数
+        self._ponder_thread = None
+
+    def _start_pondering(self, board, move):
+        """
+        在棋盘副本上落下自己的子，启动后台搜索；此时搜索树的根已经换到该局面
+        :param board: 自己落子前的棋盘局面
+        :param move: 自己的落子
+        """
+        state = copy.deepcopy(board)
+        state.do_move(move)
+        if state.game_end()[0]:
+            return
+        self.ponder_playouts = 0
+        self._ponder_thread = StoppableThread(target=self._ponder, args=(state,), daemon=True)
+        self._ponder_thread.start()
+
+    def _ponder(self, state):
+        """
+        后台搜索，每次模拟check_every次，直到被停止或达到ponder_limit
+        """
+        thread = self._ponder_thread
+        self.mcts._anytime, self.mcts._deadline = False, None
+        while not thread.stopped() and self.ponder_playouts < self.ponder_limit:
+            start = time.perf_counter()
+            self.ponder_playouts += self.mcts._search(
+                state, min(self.mcts.check_every, self.ponder_limit - self.ponder_playouts))
+            if self.ponder_duty < 1:
+                time.sleep((time.perf_counter() - start) * (1 - self.ponder_duty) / self.ponder_duty)
+
+    def stop_pondering(self):
+        """
+        停止后台搜索并等待线程退出，之后才能再访问搜索树
+        """
+        if self._ponder_thread is not None:
+            self._ponder_thread.stop()
+            self._ponder_thread.join()
+            self._ponder_thread = None
+
+    def _sync_tree(self, board):
+        """
+        人机对弈时，用对手的落子换根；只有棋盘恰好比上一次自己落子前多两步、且倒数第二步是自己的落子时才能复用，
+        否则（悔棋、换了棋盘等）重建搜索树
+        :param board: 棋盘局面
+        """
+        move_stack = board.move_stack
+        if (self._last_move != -1 and len(move_stack) == self._n_stones + 2
+                and move_stack[-2][0] == self._last_move):
+            self.mcts.update_with_move(board.last_move)
+        else:
+            self.mcts.update_with_move(-1)
+        self._last_move = -1
 
     def get_action(self, board, temperature=1e-3, return_prob: bool = False):
         """
@@ -177,7 +810,17 @@ class MCTSPlayer(PlayerBase):
         move_probs = np.zeros(board.width*board.height) # 相当于打表，
         if len(sensible_moves) > 0:
             # 还有落子的位置
-            acts, probs = self.mcts.get_move_probs(board, temperature)
+            if not self.is_self_play and self.reuse_tree:
+                self.stop_pondering()
+                self._sync_tree(board)
+            self.reused_visits = int(np.sum(self.mcts._root_action_visits()[1]))
+            move = forced_move(board, self.vcf_depth) if self.tactics else None
+            self.forced = move is not None
+            if self.forced:
+                # 强制着法，不再搜索
+                acts, probs = (move,), np.ones(1)
+            else:
+                acts, probs = self.mcts.get_move_probs(board, temperature, self.time_limit, self.node_budget)
             move_probs[list(acts)] = probs # 设置对应落子位置的概率
             if self.is_self_play:
                 # 自我博弈收集数据
@@ -190,9 +833,16 @@ class MCTSPlayer(PlayerBase):
             else:
                 # 人机对弈
                 move = np.random.choice(acts, p=probs)
-                # 重置根节点
-                self.mcts.update_with_move(-1)
-                print("AI落子：{}".format(board.move_to_location(move)))
+                if self.reuse_tree:
+                    # 先用自己的落子换根，下一步再用对手的落子换根
+                    self.mcts.update_with_move(move)
+                    self._last_move, self._n_stones = move, len(board.move_stack)
+                    if self.ponder:
+                        self._start_pondering(board, move)
+                else:
+                    # 重置根节点
+                    self.mcts.update_with_move(-1)
+                print("AI落子：{}，复用访问次数：{}".format(board.move_to_location(move), self.reused_visits))
 
             if return_prob:
                 return move, move_probs
@@ -206,4 +856,13 @@ class MCTSPlayer(PlayerBase):
         """
         :return:
         """
+        self.stop_pondering()
         self.mcts.update_with_move(-1)
+        self._last_move = -1
+
+    def set_end(self):
+        """
+        棋局结束，停止后台搜索
+        """
+        self.stop_pondering()
+        super(MCTSPlayer, self).set_end()
@@ -0,0 +1,159 @@
+import numpy as np
+
+from gobang.backend.board import Board
+from gobang.backend.mcts_alphaZero import MCTS, terminal_value
+
+
+class ArrayMCTS(MCTS):
+    """
+    数组实现的蒙特卡洛搜索树，结点不再是TreeNode对象，而是预分配的NumPy数组中的一个下标
+    同一结点的子结点在数组中连续存放，选择时对这一段做一次向量化的argmax
+    搜索结果与MCTS完全一致
+    """
+
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000, undo_search=False, capacity=1 << 16):
+        """
+        :param capacity: 初始结点容量，不够时扩容；换根时若已用过半，只保留新根的子树
+        """
+        super(ArrayMCTS, self).__init__(policy_value_fn, c_puct, n_playout, undo_search)
+        self._allocate(capacity)
+        self._reset_tree()
+
+    def _allocate(self, capacity):
+        self._capacity = capacity
+        self._n_visits = np.zeros(capacity, dtype=np.int64)  # 访问次数
+        self._Q = np.zeros(capacity)  # Q值
+        self._P = np.zeros(capacity)  # 先验概率
+        self._action = np.full(capacity, -1, dtype=np.int64)  # 从父结点到该结点的动作
+        self._first_child = np.zeros(capacity, dtype=np.int64)  # 第一个子结点的下标
+        self._n_children = np.zeros(capacity, dtype=np.int64)  # 子结点个数，0即叶结点
+
+    def _reset_tree(self):
+        """
+        新建一棵只有根结点的树
+        """
+        self._root = 0
+        self._size = 1
+        self._n_visits[0], self._Q[0], self._P[0], self._action[0], self._n_children[0] = 0, 0.0, 1.0, -1, 0
+
+    def _playout(self, state: Board, stats=None):
+        """
+        从根节点出发，完整的执行MCTS的选择，扩展，评估和回传
+        :param state: 根节点（棋盘局面）
+        :param stats: 不使用，这种树不支持instrument，只为与MCTS._search中的调用一致
+        :return: None
+        """
+        node = self._root
+        path = [node]
+        # 选择，直到叶节点
+        while self._n_children[node]:
+            start = self._first_child[node]
+            end = start + self._n_children[node]
+            n_visits = self._n_visits[start:end]
+            u = self._c_puct * self._P[start:end] * np.sqrt(self._n_visits[node]) / (1 + n_visits)
+            node = start + int(np.argmax(self._Q[start:end] + u))
+            state.do_move(int(self._action[node]))
+            path.append(node)
+        # 扩展，评估
+        action_priors, leaf_value = self._policy(state)
+        leaf_value = float(leaf_value)
+        end, winner = state.game_end()
+        if not end:
+            self._expand(node, action_priors)
+        else:
+            leaf_value = terminal_value(state, winner)
+        # 回传，从叶结点到根结点，值交替取反
+        path = np.array(path[::-1])
+        values = np.full(len(path), -leaf_value, dtype=float)
+        values[1::2] = leaf_value
+        self._n_visits[path] += 1
+        self._Q[path] += 1.0 * (values - self._Q[path]) / self._n_visits[path]
+        if self._undo_search:
+            for _ in range(len(path) - 1):
+                state.undo_move()
+
+    def _expand(self, node, action_priors):
+        """
+        在数组末尾连续分配node的全部子结点
+        """
+        actions, priors = zip(*action_priors)
+        k = len(actions)
+        if self._size + k > self._capacity:
+            self._grow(max(2 * self._capacity, self._size + k))
+        start = self._size
+        end = start + k
+        self._n_visits[start:end] = 0
+        self._Q[start:end] = 0.0
+        self._P[start:end] = priors
+        self._action[start:end] = actions
+        self._n_children[start:end] = 0
+        self._first_child[node] = start
+        self._n_children[node] = k
+        self._size = end
+
+    def _grow(self, capacity):
+        old = self._n_visits, self._Q, self._P, self._action, self._first_child, self._n_children
+        self._allocate(capacity)
+        for new_array, old_array in zip((self._n_visits, self._Q, self._P, self._action, self._first_child,
+                                         self._n_children), old):
+            new_array[:len(old_array)] = old_array
+
+    def _compact(self):
+        """
+        只保留根结点的子树，按层重新排列到数组前部，丢弃已经用不到的结点
+        """
+        arrays = (self._n_visits, self._Q, self._P, self._action, self._first_child, self._n_children)
+        old = tuple(array.copy() for array in arrays)
+        old_children = old[5]
+        old_first = old[4]
+        for array, old_array in zip(arrays, old):
+            array[0] = old_array[self._root]
+        # queue中为(旧下标, 新下标)
+        queue = [(self._root, 0)]
+        size = 1
+        for old_node, new_node in queue:
+            k = old_children[old_node]
+            if not k:
+                continue
+            start = old_first[old_node]
+            for array, old_array in zip(arrays, old):
+                array[size:size + k] = old_array[start:start + k]
+            self._first_child[new_node] = size
+            queue.extend((start + i, size + i) for i in range(k) if old_children[start + i])
+            size += k
+        self._root = 0
+        self._size = size
+
+    def node_count(self):
+        """
+        :return: 数组中已占用的结点数，含换根后尚未整理掉的旧结点
+        """
+        return self._size
+
+    def tree_memory(self):
+        """
+        :return: 结点数组占用的字节数（按容量计）
+        """
+        return sum(array.nbytes for array in (self._n_visits, self._Q, self._P, self._action, self._first_child,
+                                              self._n_children))
+
+    def _root_action_visits(self):
+        start = self._first_child[self._root]
+        end = start + self._n_children[self._root]
+        return tuple(self._action[start:end].tolist()), self._n_visits[start:end]
+
+    def update_with_move(self, last_move):
+        """
+        复用搜索子树，原先的其余结点留在数组中，等空间不够时再整理
+        :param last_move:
+        :return:
+        """
+        start = self._first_child[self._root]
+        end = start + self._n_children[self._root]
+        index = np.flatnonzero(self._action[start:end] == last_move)
+        if len(index):
+            self._root = start + int(index[0])
+            if self._size > self._capacity // 2:
+                self._compact()
+        else:
+            self._reset_tree()
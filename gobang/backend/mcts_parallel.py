@@ -0,0 +1,117 @@
+import multiprocessing
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from gobang.backend.board import Board
+from gobang.backend.mcts_alphaZero import MCTS
+
+
+def _worker_loop(conn, policy_factory, c_puct, n_playout, seed, mcts_kwargs):
+    """
+    子进程：加载一次模型，之后按命令搜索、换根，直到收到close
+    :param conn: 与主进程通信的管道
+    :param policy_factory: 无参可调用对象，返回policy_value_fn
+    """
+    np.random.seed(seed)
+    mcts = MCTS(policy_factory(), c_puct, n_playout, True, **mcts_kwargs)
+    while True:
+        command, arg = conn.recv()
+        if command == "search":
+            mcts.get_move_probs(*arg)
+            acts, visits = mcts._root_action_visits()
+            conn.send((list(acts), [int(v) for v in visits], mcts.n_playouts_done))
+        elif command == "move":
+            mcts.update_with_move(arg)
+        elif command == "visits":
+            acts, visits = mcts._root_action_visits()
+            conn.send((list(acts), [int(v) for v in visits]))
+        elif command == "close":
+            conn.close()
+            return
+
+
+class RootParallelMCTS(MCTS):
+    """
+    根并行的蒙特卡洛树搜索：n_workers个子进程各自维护一棵树，用不同的随机种子和根节点Dirichlet噪声搜索同一局面，
+    再把根节点各动作的访问次数相加，经温度softmax得到落子概率
+    子进程在多步之间常驻，模型只加载一次，每步只需把棋盘发过去
+    """
+
+    def __init__(self, policy_value_fn=None, c_puct=5, n_playout=10000, undo_search=True, n_workers=2,
+                 policy_factory=None, root_noise_alpha=0.3, root_noise_eps=0.25, seed=0, **mcts_kwargs):
+        """
+        :param policy_value_fn: 不使用，子进程通过policy_factory自己加载模型
+        :param n_playout: 每个子进程每步的模拟次数，time_limit、node_budget也同样作用于每个子进程
+        :param n_workers: 子进程个数
+        :param policy_factory: 可序列化的无参可调用对象，返回policy_value_fn，
+            如functools.partial(load_policy_value_fn, width, height, model_file)
+        :param seed: 第i个子进程的随机种子为seed + i
+        :param mcts_kwargs: 传给子进程中MCTS的其余参数
+        """
+        super(RootParallelMCTS, self).__init__(policy_value_fn, c_puct, n_playout, undo_search)
+        assert policy_factory is not None, "policy_factory is required"
+        mcts_kwargs.update(root_noise_alpha=root_noise_alpha, root_noise_eps=root_noise_eps)
+        context = multiprocessing.get_context("spawn")
+        self._conns, self._workers = [], []
+        for i in range(n_workers):
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(target=_worker_loop, daemon=True,
+                                     args=(child_conn, policy_factory, c_puct, n_playout, seed + i, mcts_kwargs))
+            worker.start()
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+        self._action_visits = {}  # 汇总的根节点访问次数，换根后为None，用到时再向子进程查询
+
+    def _merge_visits(self, replies):
+        """
+        汇总各子进程的根节点访问次数
+        :param replies: 各子进程的(动作列表, 访问次数列表)
+        """
+        action_visits = defaultdict(int)
+        for acts, visits in replies:
+            for act, visit in zip(acts, visits):
+                action_visits[act] += visit
+        self._action_visits = dict(action_visits)
+
+    def _search(self, state: Board, budget):
+        """
+        各子进程同时搜索，汇总根节点的访问次数
+        :return: 全部子进程的模拟次数之和
+        """
+        time_limit = self._deadline - time.perf_counter() if self._deadline is not None else None
+        # 没给时间限制和模拟次数上限时不传node_budget，子进程照常模拟满n_playout，不会提前结束
+        node_budget = budget if self._anytime else None
+        for conn in self._conns:
+            conn.send(("search", (state, 1e-3, time_limit, node_budget)))
+        replies = [conn.recv() for conn in self._conns]
+        self._merge_visits((acts, visits) for acts, visits, _ in replies)
+        return sum(n for _, _, n in replies)
+
+    def _root_action_visits(self):
+        if self._action_visits is None:
+            # 换根后各子进程复用的子树根节点下的访问次数
+            for conn in self._conns:
+                conn.send(("visits", None))
+            self._merge_visits([conn.recv() for conn in self._conns])
+        acts = tuple(sorted(self._action_visits))
+        return acts, [self._action_visits[act] for act in acts]
+
+    def update_with_move(self, last_move):
+        """
+        各子进程分别复用搜索子树
+        """
+        for conn in self._conns:
+            conn.send(("move", last_move))
+        self._action_visits = None
+
+    def close(self):
+        """
+        结束全部子进程
+        """
+        for conn, worker in zip(self._conns, self._workers):
+            if worker.is_alive():
+                conn.send(("close", None))
+            worker.join()
+        self._conns, self._workers = [], []
@@ -0,0 +1,207 @@
+import sys
+from collections import OrderedDict
+from itertools import islice
+
+import numpy as np
+
+from gobang.backend.board import Board
+from gobang.backend.mcts_alphaZero import MCTS, terminal_value
+
+
+class DagNode:
+    """
+    置换表搜索中的结点（一个局面），可以有多个父结点
+    Q值、访问次数属于局面，先验概率和经过该边的访问次数属于边
+    """
+    __slots__ = ("n_visits", "Q", "edges", "n_stones")
+
+    def __init__(self, n_stones=None):
+        """
+        :param n_stones: 局面上的棋子数，用于换根后清理置换表中再也到不了的局面
+        """
+        self.n_visits = 0
+        self.Q = 0.0  # 从走到该局面的玩家的角度看的Q值
+        # {动作: [先验概率, 经过该边的访问次数, 子结点的局面哈希或None]}，None即未扩展；
+        # 边上只存哈希，子结点只由置换表持有，被淘汰后即可回收
+        self.edges = None
+        self.n_stones = n_stones
+
+    def expand(self, actions_priors):
+        self.edges = {action: [prior, 0, None] for action, prior in actions_priors}
+
+    def update(self, leaf_value):
+        self.n_visits += 1
+        self.Q += 1.0 * (leaf_value - self.Q) / self.n_visits
+
+    def select(self, c_puct, table):
+        """
+        在边中选择Q+U最大的动作，Q取子结点的Q值（子结点已被淘汰时为0），U按经过该边的访问次数计算
+        :param table: 置换表 {局面哈希: DagNode}
+        :return: Tuple(动作，边)
+        """
+        sqrt_n = np.sqrt(self.n_visits)
+        best_value, best = -float("inf"), None
+        get = table.get  # 哈希为None（未经过的边）时也取到None
+        for action, edge in self.edges.items():
+            prior, n_visits, key = edge
+            child = get(key)
+            q = child.Q if child is not None and child.n_visits else 0.0
+            value = q + c_puct * prior * sqrt_n / (1 + n_visits)
+            if value > best_value:
+                best_value, best = value, (action, edge)
+        return best
+
+
+class TranspositionMCTS(MCTS):
+    """
+    带置换表的蒙特卡洛搜索：不同走子顺序到达的同一局面（Zobrist哈希相同）共用一个结点，
+    搜索树变成有向无环图，局面只需网络评估一次，统计量也不再分散在多个分支上
+    置换表大小有限，满了之后淘汰最久未经过的局面（根结点和本次模拟路径上的结点除外）；
+    边上只存子结点的哈希，被淘汰的结点不再被引用，内存随即释放，再次到达该局面时重新建立结点
+    """
+
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000, undo_search=False, table_size=200000):
+        """
+        :param table_size: 置换表最多保存的局面数
+        """
+        super(TranspositionMCTS, self).__init__(policy_value_fn, c_puct, n_playout, undo_search)
+        self._table_size = table_size
+        self._table = OrderedDict()  # {局面哈希: DagNode}，按最近经过的先后排列
+        self._root = DagNode()
+        self._root_key = None
+        # 最近一次搜索的置换表统计
+        self.tt_stats = {}
+
+    def _lookup(self, state: Board):
+        """
+        经过还没有记下子结点的边，或子结点已被淘汰时调用：取局面对应的结点，置换表中没有则新建并加入
+        """
+        key = state.zobrist_key
+        node = self._table.get(key)
+        if node is not None:
+            self._table.move_to_end(key)
+            self.tt_stats["hits"] += 1
+            if node.edges is not None:
+                self.tt_stats["nn_calls_saved"] += 1
+            return node
+        self.tt_stats["misses"] += 1
+        node = DagNode(len(state.states))
+        self._table[key] = node
+        return node
+
+    def _evict(self, path):
+        """
+        置换表超出大小时，从最久未经过的局面开始淘汰，跳过根结点和本次模拟路径上的结点
+        :param path: 本次模拟路径上的结点
+        """
+        table = self._table
+        excess = len(table) - self._table_size
+        protected = {id(node) for node in path}
+        protected.add(id(self._root))
+        # 路径上的结点刚被移到末尾，最旧的excess + len(protected)个局面中一定有excess个可以淘汰
+        for key in list(islice(table, excess + len(protected))):
+            if id(table[key]) not in protected:
+                del table[key]
+                excess -= 1
+                if excess == 0:
+                    break
+
+    def _playout(self, state: Board, stats=None):
+        """
+        从根结点出发选择到未扩展的结点，经过还没有子结点的边时先查置换表；
+        评估、扩展后沿实际走过的路径回传
+        :param state: 根节点（棋盘局面）
+        :param stats: 不使用，这种树不支持instrument，只为与MCTS._search中的调用一致
+        """
+        table = self._table
+        # 经过的结点都移到置换表末尾，常用的局面不会被淘汰
+        table.move_to_end(self._root_key)
+        node = self._root
+        path = []  # [(结点, 边)]
+        while node.edges:
+            action, edge = node.select(self._c_puct, table)
+            state.do_move(action)
+            path.append((node, edge))
+            key = edge[2]
+            child = table.get(key)
+            if child is None:
+                child = self._lookup(state)
+                edge[2] = state.zobrist_key
+            else:
+                table.move_to_end(key)
+            node = child
+
+        end, winner = state.game_end()
+        if not end:
+            action_priors, leaf_value = self._policy(state)
+            self.tt_stats["nn_calls"] += 1
+            node.expand(action_priors)
+            leaf_value = float(leaf_value)
+        else:
+            leaf_value = terminal_value(state, winner)
+
+        # 回传：叶结点从走到它的玩家角度取反，往上逐层交替
+        leaf_value = -leaf_value
+        node.update(leaf_value)
+        for parent, edge in reversed(path):
+            leaf_value = -leaf_value
+            edge[1] += 1
+            parent.update(leaf_value)
+        if self._undo_search:
+            for _ in range(len(path)):
+                state.undo_move()
+        if len(table) > self._table_size:
+            self._evict([parent for parent, _ in path] + [node])
+
+    def _search(self, state: Board, budget):
+        self.tt_stats = {"hits": 0, "misses": 0, "nn_calls": 0, "nn_calls_saved": 0}
+        if self._root.n_stones is None:
+            # 新的根结点，加入置换表
+            self._root.n_stones = len(state.states)
+            self._root_key = state.zobrist_key
+            self._table[self._root_key] = self._root
+        n = super(TranspositionMCTS, self)._search(state, budget)
+        lookups = self.tt_stats["hits"] + self.tt_stats["misses"]
+        self.tt_stats["hit_rate"] = self.tt_stats["hits"] / lookups if lookups else 0.0
+        self.tt_stats["table_size"] = len(self._table)
+        return n
+
+    def node_count(self):
+        """
+        :return: 置换表中的局面数，即全部结点数（边不引用结点）
+        """
+        return len(self._table)
+
+    def tree_memory(self):
+        """
+        :return: 置换表中的结点及其边占用的字节数
+        """
+        total = sys.getsizeof(self._table)
+        for node in self._table.values():
+            total += sys.getsizeof(node)
+            if node.edges is not None:
+                total += sys.getsizeof(node.edges) + sum(sys.getsizeof(edge) for edge in node.edges.values())
+        return total
+
+    def _root_action_visits(self):
+        if not self._root.edges:
+            return (), []
+        acts = tuple(self._root.edges)
+        return acts, [edge[1] for edge in self._root.edges.values()]
+
+    def update_with_move(self, last_move):
+        """
+        换根，并从置换表中删去棋子数不多于新根的局面，它们再也不会出现
+        :param last_move: -1时清空置换表，新建一棵树
+        """
+        edges = self._root.edges
+        key = edges[last_move][2] if edges and last_move in edges else None
+        if key is not None and key in self._table:
+            self._root, self._root_key = self._table[key], key
+            n_stones = self._root.n_stones
+            for key in [key for key, node in self._table.items()
+                        if node.n_stones <= n_stones and node is not self._root]:
+                del self._table[key]
+        else:
+            self._root, self._root_key = DagNode(), None
+            self._table.clear()
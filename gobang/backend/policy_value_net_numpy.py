@@ -0,0 +1,164 @@
+"""
+只用NumPy的策略价值网络推理，结构与policy_value_net_pytorch.Net相同，不需要导入torch
+卷积用im2col展开成矩阵乘法；参数直接从torch.save保存的.model文件（zip格式）中读取
+"""
+import pickle
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from gobang.backend.board import Board
+
+# torch存储类型对应的NumPy类型
+_STORAGE_DTYPES = {
+    "FloatStorage": np.float32, "DoubleStorage": np.float64, "HalfStorage": np.float16,
+    "LongStorage": np.int64, "IntStorage": np.int32, "ShortStorage": np.int16,
+    "CharStorage": np.int8, "ByteStorage": np.uint8, "BoolStorage": np.bool_,
+}
+
+
+def _rebuild_tensor(storage, storage_offset, size, stride, *args):
+    """
+    按偏移和步长从存储中取出张量，对应torch._utils._rebuild_tensor_v2
+    """
+    itemsize = storage.dtype.itemsize
+    array = np.lib.stride_tricks.as_strided(storage[storage_offset:], shape=tuple(size),
+                                            strides=tuple(s * itemsize for s in stride))
+    return np.array(array)
+
+
+class _StateDictUnpickler(pickle.Unpickler):
+    """
+    解析.model中的data.pkl，张量的存储从zip中的data/目录读取
+    """
+
+    def __init__(self, file, archive: zipfile.ZipFile, prefix):
+        super(_StateDictUnpickler, self).__init__(file)
+        self.archive = archive
+        self.prefix = prefix
+
+    def find_class(self, module, name):
+        if module == "torch._utils" and name == "_rebuild_tensor_v2":
+            return _rebuild_tensor
+        if module == "torch" and name in _STORAGE_DTYPES:
+            return _STORAGE_DTYPES[name]
+        if module == "collections" and name == "OrderedDict":
+            return OrderedDict
+        raise pickle.UnpicklingError("不支持的对象：{}.{}".format(module, name))
+
+    def persistent_load(self, pid):
+        # ('storage', 存储类型, 文件名, 设备, 元素个数)
+        _, dtype, key, _, _ = pid
+        return np.frombuffer(self.archive.read("{}/data/{}".format(self.prefix, key)), dtype=dtype)
+
+
+def load_state_dict(model_file):
+    """
+    不用torch读取torch.save保存的state_dict
+    :return: OrderedDict{参数名: np.ndarray}
+    """
+    with zipfile.ZipFile(model_file) as archive:
+        pkl = next(name for name in archive.namelist() if name.endswith("/data.pkl"))
+        prefix = pkl[:-len("/data.pkl")]
+        with archive.open(pkl) as file:
+            return _StateDictUnpickler(file, archive, prefix).load()
+
+
+def _conv3x3_relu(x, weight, bias):
+    """
+    3x3卷积（padding=1）+ReLU：im2col后做一次矩阵乘法
+    :param x: shape(N, H, W, C)
+    :param weight: shape(9 * C, 输出通道)，按(kh, kw, C)展开
+    :return: shape(N, H, W, 输出通道)
+    """
+    n, h, w, c = x.shape
+    padded = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)))
+    # 9个平移后的切片沿通道拼接，每块都是连续复制，比按(C, kh, kw)取窗口快
+    patches = np.concatenate([padded[:, i:i + h, j:j + w, :] for i in range(3) for j in range(3)], axis=3)
+    out = patches.reshape(n * h * w, 9 * c) @ weight
+    out += bias
+    np.maximum(out, 0, out=out)
+    return out.reshape(n, h, w, -1)
+
+
+class NumpyPolicyValueNet:
+    """
+    接口与PolicyValueNet的推理部分一致：policy_value_fn、policy_value_states、policy_value_batch
+    """
+
+    def __init__(self, width, height, model_file):
+        """
+        :param model_file: PolicyValueNet.save_model保存的.model文件
+        """
+        self.board_width = width
+        self.board_height = height
+        params = {name: np.ascontiguousarray(value, dtype=np.float32)
+                  for name, value in load_state_dict(model_file).items()}
+        # 卷积核(输出通道, C, kh, kw)转成im2col用的矩阵 shape(9 * C, 输出通道)
+        self.convs = [(params[name + ".weight"].transpose(2, 3, 1, 0).reshape(-1, len(params[name + ".weight"])).copy(),
+                       params[name + ".bias"]) for name in ("conv1", "conv2", "conv3")]
+        # 1x1卷积即逐位置的矩阵乘法 shape(128, 输出通道)
+        self.action_conv = (params["action_conv1.weight"][:, :, 0, 0].T.copy(), params["action_conv1.bias"])
+        self.value_conv = (params["value_conv1.weight"][:, :, 0, 0].T.copy(), params["value_conv1.bias"])
+        self.action_fc = (params["action_fc1.weight"].T.copy(), params["action_fc1.bias"])
+        self.value_fc1 = (params["value_fc1.weight"].T.copy(), params["value_fc1.bias"])
+        self.value_fc2 = (params["value_fc2.weight"].T.copy(), params["value_fc2.bias"])
+
+    def forward(self, state_batch: np.ndarray):
+        """
+        :param state_batch: shape(N, 4, height, width)
+        :return: Tuple(对数落子概率 shape(N, width * height)，局面评估值 shape(N, 1))
+        """
+        n = len(state_batch)
+        # 内部用NHWC，im2col更方便
+        x = np.ascontiguousarray(state_batch.transpose(0, 2, 3, 1), dtype=np.float32)
+        for weight, bias in self.convs:
+            x = _conv3x3_relu(x, weight, bias)
+
+        # 策略层：1x1卷积，按NCHW的顺序展平后全连接
+        x_act = np.maximum(x @ self.action_conv[0] + self.action_conv[1], 0)
+        x_act = x_act.transpose(0, 3, 1, 2).reshape(n, -1) @ self.action_fc[0] + self.action_fc[1]
+        x_act -= x_act.max(axis=1, keepdims=True)
+        x_act -= np.log(np.exp(x_act).sum(axis=1, keepdims=True))
+
+        # 价值层
+        x_val = np.maximum(x @ self.value_conv[0] + self.value_conv[1], 0)
+        x_val = np.maximum(x_val.transpose(0, 3, 1, 2).reshape(n, -1) @ self.value_fc1[0] + self.value_fc1[1], 0)
+        x_val = np.tanh(x_val @ self.value_fc2[0] + self.value_fc2[1])
+        return x_act, x_val
+
+    def policy_value_fn(self, board: Board):
+        availables = board.legal_moves
+        log_act_probs, value = self.forward(board.current_state()[np.newaxis])
+        act_probs = np.exp(log_act_probs.ravel())
+        return zip(availables.tolist(), act_probs[availables].tolist()), float(value[0, 0])
+
+    def policy_value_states(self, state_batch: np.ndarray):
+        """
+        一次前向计算评估一批局面
+        :param state_batch: shape(N, 4, height, width)
+        :return: Tuple(落子概率 shape(N, width * height)，局面评估值 shape(N, ))
+        """
+        log_act_probs, value = self.forward(state_batch)
+        return np.exp(log_act_probs), value.reshape(-1)
+
+    def policy_value_batch(self, boards):
+        """
+        一次前向计算评估多个棋盘
+        :param boards: List[Board]，大小须与网络一致
+        :return: Tuple(落子概率 shape(N, width * height)，不可落子的位置为0，局面评估值 shape(N, ))
+        """
+        states = np.empty((len(boards), 4, self.board_height, self.board_width), dtype=np.float32)
+        for board, state in zip(boards, states):
+            board.current_state(out=state)
+        act_probs, value = self.policy_value_states(states)
+        act_probs *= np.array([board.legal_mask for board in boards])
+        return act_probs, value
+
+
+def load_policy_value_fn(width, height, model_file):
+    """
+    加载模型并返回其policy_value_fn，可用functools.partial包装后传给子进程
+    """
+    return NumpyPolicyValueNet(width, height, model_file).policy_value_fn
@@ -2,19 +2,19 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch import optim
-from torch.autograd import Variable
 from torch.nn import functional as F
 
 from gobang.backend.board import Board
+from gobang.backend.inference_backend import TorchScriptBackend
+from gobang.backend.quantization import QuantizedBackend, quantize_dynamic
 
 def set_learning_rate(optimizer, lr):
     for param_group in optimizer.param_groups:
         param_group["lr"] = lr
 
 
+# 默认设备：有GPU时用GPU，否则用CPU；也可以在构造PolicyValueNet时指定
 use_gpu = torch.cuda.is_available()
-print(use_gpu)
-use_gpu = True
 # 使用三层全卷积网络，而不是残差网络
 
 
@@ -66,41 +66,94 @@ class Net(nn.Module):
 
 
 class PolicyValueNet:
-    def __init__(self, width, height, model_file=None):
+    def __init__(self, width, height, model_file=None, device=None, num_threads=None, backend=None, quantize=None):
+        """
+        :param device: 运行网络的设备，如"cpu"、"cuda"，None即有GPU时用GPU；构造时确定，模型只移动一次
+        :param num_threads: CPU推理的算子内线程数（torch.set_num_threads，对整个进程生效），None即不修改
+        :param backend: 推理后端，如inference_backend.load_backend加载的导出模型，None即用eager模型推理；训练总是用eager模型
+        :param quantize: INT8推理（只能在CPU上）："dynamic"即加载后对全连接层做动态量化，每次训练后重新量化；
+            也可以是quantization工具导出的INT8模型(.pt)路径，其中卷积层已静态量化，训练不会更新它
+        """
         self.board_width = width
         self.board_height = height
         self.l2_const = 1e-4
+        self.device = torch.device(device or ("cuda" if use_gpu else "cpu"))
+        self.backend = backend
+        if num_threads:
+            torch.set_num_threads(num_threads)
         self.policy_value_net = Net(width, height)
+        if model_file:
+            # GPU上保存的模型也能在CPU上加载
+            net_params = torch.load(model_file, map_location=self.device)
+            self.policy_value_net.load_state_dict(net_params)
+        self.policy_value_net.to(self.device)
+        self.policy_value_net.eval()
+        self.quantize = quantize
+        # policy_value_batch复用的输入、掩码缓冲区，批大小超出时再扩大
+        self._batch_states = np.zeros((0, 4, height, width), dtype=np.float32)
+        self._batch_masks = np.zeros((0, width * height), dtype=bool)
+        if quantize:
+            if self.device.type != "cpu":
+                raise ValueError("量化模型只能在CPU上运行，device: {}".format(self.device))
+            self.backend = (QuantizedBackend(quantize_dynamic(self.policy_value_net)) if quantize == "dynamic"
+                            else TorchScriptBackend(quantize))
         self.optimizer = optim.Adam(
             self.policy_value_net.parameters(),
             weight_decay=self.l2_const
         )
-        if model_file:
-            net_params = torch.load(model_file)
-            self.policy_value_net.load_state_dict(net_params)
 
     def policy_value_fn(self, board: Board):
-        availables = board.available
-        current_states = np.ascontiguousarray(
-            board.current_state().reshape((-1, 4, self.board_width, self.board_height)))
-        # 这就核心的预测
-        current_states_tensor = Variable(torch.from_numpy(current_states)).float()
+        availables = board.legal_moves
+        if self.backend is not None:
+            log_act_probs, value = self.backend(board.current_state()[np.newaxis])
+            act_probs = np.exp(log_act_probs.ravel())
+        else:
+            # current_state已是连续的float32数组，from_numpy不复制
+            current_states = torch.from_numpy(board.current_state()).unsqueeze(0).to(self.device)
+            # 这就核心的预测
+            with torch.inference_mode():
+                log_act_probs, value = self.policy_value_net(current_states)
+            act_probs = np.exp(log_act_probs.cpu().numpy().ravel())
+        # 所有可行位置及其对应落子概率，转成Python数值，搜索时的运算更快
+        act_probs = zip(availables.tolist(), act_probs[availables].tolist())
+        # 局面评估值
+        value = value.item()
+        return act_probs, value
 
-        if use_gpu:
-            current_states_tensor = current_states_tensor.cuda()
-            self.policy_value_net = self.policy_value_net.cuda()
+    def policy_value_states(self, state_batch: np.ndarray):
+        """
+        一次前向计算评估一批局面，供MCTS批量搜索使用
+        :param state_batch: shape(N, 4, height, width)
+        :return: Tuple(落子概率 shape(N, width * height)，局面评估值 shape(N, ))
+        """
+        state_batch = np.ascontiguousarray(state_batch, dtype=np.float32)
+        if self.backend is not None:
+            log_act_probs, value = self.backend(state_batch)
+            return np.exp(log_act_probs), value.reshape(-1)
+        state_batch_tensor = torch.from_numpy(state_batch).to(self.device)
 
-        log_act_probs, value = self.policy_value_net(current_states_tensor)
+        with torch.inference_mode():
+            log_act_probs, value = self.policy_value_net(state_batch_tensor)
 
-        if use_gpu:
-            log_act_probs, value = log_act_probs.cpu(), value.cpu()
+        return np.exp(log_act_probs.cpu().numpy()), value.cpu().numpy().reshape(-1)
 
-        act_probs = np.exp(log_act_probs.data.numpy().flatten())
-        # 所有可行位置及其对应落子概率
-        act_probs = zip(availables, act_probs[availables])
-        # 局面评估值
-        # 尝试用item()替代
-        value = value.data[0][0]
+    def policy_value_batch(self, boards):
+        """
+        一次前向计算评估多个棋盘，如多局自我对弈、同时服务多盘对局
+        输入平面直接写入复用的float32缓冲区；缓冲区属于这个对象，不要在多个线程中同时调用
+        :param boards: List[Board]，大小须与网络一致
+        :return: Tuple(落子概率 shape(N, width * height)，不可落子的位置为0，局面评估值 shape(N, ))
+        """
+        n = len(boards)
+        if n > len(self._batch_states):
+            self._batch_states = np.zeros((n,) + self._batch_states.shape[1:], dtype=np.float32)
+            self._batch_masks = np.zeros((n, self._batch_masks.shape[1]), dtype=bool)
+        states, masks = self._batch_states[:n], self._batch_masks[:n]
+        for board, state, mask in zip(boards, states, masks):
+            board.current_state(out=state)
+            mask[:] = board.legal_mask
+        act_probs, value = self.policy_value_states(states)
+        act_probs *= masks
         return act_probs, value
 
     def train_step(self, state_batch, mcts_probs, winner_batch, lr):
@@ -113,41 +166,31 @@ class PolicyValueNet:
         :return:
         """
         # 转为张量
-        state_batch = Variable(torch.FloatTensor(state_batch))
-        mcts_probs = Variable(torch.FloatTensor(mcts_probs))
-        winner_batch = Variable(torch.FloatTensor(winner_batch))
+        state_batch = torch.as_tensor(np.array(state_batch, dtype=np.float32), device=self.device)
+        mcts_probs = torch.as_tensor(np.array(mcts_probs, dtype=np.float32), device=self.device)
+        winner_batch = torch.as_tensor(np.array(winner_batch, dtype=np.float32), device=self.device)
 
+        self.policy_value_net.train()
         # 梯度清零，此处需要再研究
         self.optimizer.zero_grad()
         # 设置学习率
         set_learning_rate(self.optimizer, lr)
         # 前向训练
-
-        if use_gpu:
-            state_batch = state_batch.cuda()
-            self.policy_value_net = self.policy_value_net.cuda()
-
         log_act_probs, value = self.policy_value_net(state_batch)
 
-        if use_gpu:
-            log_act_probs, value = log_act_probs.cpu(), value.cpu()
-
         # 定义损失函数
         value_loss = F.mse_loss(value.view(-1), winner_batch)
         policy_loss = -torch.mean(torch.sum(mcts_probs * log_act_probs, 1))
         loss: torch.Tensor = value_loss + policy_loss
-
-        if use_gpu:
-            loss = loss.cuda()
         # 反向回溯并优化
         loss.backward()
-
-        if use_gpu:
-            loss = loss.cpu()
-
         self.optimizer.step()
+        self.policy_value_net.eval()
+        if self.quantize == "dynamic":
+            self.backend = QuantizedBackend(quantize_dynamic(self.policy_value_net))
         # 观察用的策略熵
-        entropy = -torch.mean(torch.sum(torch.exp(log_act_probs) * log_act_probs, 1))
+        with torch.no_grad():
+            entropy = -torch.mean(torch.sum(torch.exp(log_act_probs) * log_act_probs, 1))
         # return loss.data[0], entropy.data[0]
         return loss.item(), entropy.item()
 
@@ -158,3 +201,10 @@ class PolicyValueNet:
     def save_model(self, model_file):
         net_params = self.get_policy_param()
         torch.save(net_params, model_file)
+
+
+def load_policy_value_fn(width, height, model_file=None, device=None, num_threads=None, quantize=None):
+    """
+    加载模型并返回其policy_value_fn，可用functools.partial包装后传给子进程，由子进程自己加载模型
+    """
+    return PolicyValueNet(width, height, model_file, device, num_threads, quantize=quantize).policy_value_fn
@@ -0,0 +1,230 @@
+"""
+策略价值网络的INT8量化，用于CPU上对弈：
+全连接层用动态量化（权重INT8，激活运行时量化）；卷积层用静态量化，激活的量化参数由自我对弈局面校准
+量化模型用trace保存为TorchScript(.pt)，可用inference_backend.load_backend加载，或传给PolicyValueNet(quantize=...)
+用法：python -m gobang.backend.quantization gobang/resources/current_policy15x15.model --size 15
+"""
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+import torch.ao.quantization as tq
+import torch.nn as nn
+from torch.nn import functional as F
+
+
+class QuantizableNet(nn.Module):
+    """
+    与Net相同的计算，但加上量化/反量化的边界并把ReLU写成模块，以便融合卷积+ReLU后做静态量化：
+    卷积部分在INT8上计算，进入全连接层前反量化回float
+    """
+
+    def __init__(self, net: nn.Module):
+        """
+        :param net: 训练好的Net，参数会被复制
+        """
+        super(QuantizableNet, self).__init__()
+        self.board_width = net.board_width
+        self.board_height = net.board_height
+        self.quant = tq.QuantStub()
+        self.dequant = tq.DeQuantStub()
+
+        # 公共层
+        self.conv1, self.relu1 = copy.deepcopy(net.conv1), nn.ReLU()
+        self.conv2, self.relu2 = copy.deepcopy(net.conv2), nn.ReLU()
+        self.conv3, self.relu3 = copy.deepcopy(net.conv3), nn.ReLU()
+
+        # 策略层
+        self.action_conv1, self.action_relu = copy.deepcopy(net.action_conv1), nn.ReLU()
+        self.action_fc1 = copy.deepcopy(net.action_fc1)
+
+        # 价值层
+        self.value_conv1, self.value_relu = copy.deepcopy(net.value_conv1), nn.ReLU()
+        self.value_fc1 = copy.deepcopy(net.value_fc1)
+        self.value_fc2 = copy.deepcopy(net.value_fc2)
+
+    def fuse(self):
+        """
+        融合卷积+ReLU，量化后是一个算子
+        """
+        tq.fuse_modules(self, [["conv1", "relu1"], ["conv2", "relu2"], ["conv3", "relu3"],
+                               ["action_conv1", "action_relu"], ["value_conv1", "value_relu"]], inplace=True)
+        return self
+
+    def forward(self, state_input):
+        # 公共层
+        x = self.quant(state_input)
+        x = self.relu1(self.conv1(x))
+        x = self.relu2(self.conv2(x))
+        x = self.relu3(self.conv3(x))
+
+        # 策略层
+        x_act = self.dequant(self.action_relu(self.action_conv1(x)))
+        x_act = x_act.reshape(-1, 4 * self.board_width * self.board_height)
+        x_act = F.log_softmax(self.action_fc1(x_act), dim=1)
+
+        # 价值层
+        x_val = self.dequant(self.value_relu(self.value_conv1(x)))
+        x_val = x_val.reshape(-1, 2 * self.board_width * self.board_height)
+        x_val = F.relu(self.value_fc1(x_val))
+        x_val = torch.tanh(self.value_fc2(x_val))
+        return x_act, x_val
+
+
+def quantize_dynamic(net: nn.Module):
+    """
+    全连接层动态量化，不需要校准数据
+    :param net: 训练好的Net，不会被修改
+    :return: 量化后的模型，只能在CPU上运行
+    """
+    net = copy.deepcopy(net).cpu().eval()
+    return tq.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(net: nn.Module, calibration_states: np.ndarray, engine=None, batch_size=256):
+    """
+    卷积层静态量化（按校准局面上观察到的激活范围确定量化参数），全连接层动态量化
+    :param net: 训练好的Net，不会被修改
+    :param calibration_states: 校准用局面 shape(N, 4, height, width)，最好来自自我对弈，与对弈时的分布一致
+    :param engine: 量化算子的实现，如"x86"、"fbgemm"、"qnnpack"，None即torch当前的默认值；运行量化模型时要用同一种
+    :param batch_size: 校准时每批的局面数
+    :return: 量化后的模型，只能在CPU上运行
+    """
+    engine = engine or torch.backends.quantized.engine
+    torch.backends.quantized.engine = engine
+    # QuantizableNet复制了各层参数，只移动副本，不改变调用方模型所在的设备
+    model = QuantizableNet(net).cpu().eval().fuse()
+    model.qconfig = tq.get_default_qconfig(engine)
+    # 全连接层留给动态量化
+    for linear in (model.action_fc1, model.value_fc1, model.value_fc2):
+        linear.qconfig = None
+    tq.prepare(model, inplace=True)
+    states = torch.from_numpy(np.ascontiguousarray(calibration_states, dtype=np.float32))
+    with torch.inference_mode():
+        for start in range(0, len(states), batch_size):
+            model(states[start:start + batch_size])
+    tq.convert(model, inplace=True)
+    return tq.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def save_quantized(model: nn.Module, path):
+    """
+    trace后保存为TorchScript，批大小可变；加载时不需要重建QuantizableNet
+    """
+    example = torch.zeros(1, 4, model.board_height, model.board_width)
+    with torch.no_grad():
+        module = torch.jit.trace(model, example)
+    module.save(path)
+
+
+class QuantizedBackend:
+    """
+    把量化后的模型包装成推理后端，接口与inference_backend中的后端相同
+    """
+
+    def __init__(self, model: nn.Module):
+        self.model = model
+
+    def __call__(self, state_batch: np.ndarray):
+        with torch.inference_mode():
+            log_act_probs, value = self.model(torch.from_numpy(state_batch))
+        return log_act_probs.numpy(), value.numpy()
+
+
+def self_play_states(policy_value_fn, width, height, n_games=4, n_playout=200, n_in_row=5, seed=0):
+    """
+    用MCTS自我对弈收集局面，作为校准和评估数据
+    :return: shape(N, 4, height, width)
+    """
+    from gobang.backend.board import Board
+    from gobang.backend.game import Game
+    from gobang.backend.mcts_alphaZero import MCTSPlayer
+
+    np.random.seed(seed)
+    game = Game(Board(width, height, n_in_row))
+    player = MCTSPlayer(policy_value_fn, c_puct=5, n_playout=n_playout, is_self_play=1)
+    states = []
+    for _ in range(n_games):
+        _, play_data = game.start_self_play(player, temperature=1.0)
+        states.extend(state for state, _, _ in play_data)
+    return np.stack(states).astype(np.float32)
+
+
+def compare(net: nn.Module, model, states: np.ndarray):
+    """
+    量化模型与float模型的差异
+    :param model: 量化模型或推理后端，输入shape(N, 4, height, width)的数组
+    :return: Dict(策略KL散度 KL(float || 量化) 的平均值和最大值，局面评估值绝对误差的平均值和最大值)
+    """
+    states = np.ascontiguousarray(states, dtype=np.float32)
+    with torch.inference_mode():
+        log_p, value = [out.cpu().numpy() for out in
+                        net(torch.from_numpy(states).to(next(net.parameters()).device))]
+        if isinstance(model, nn.Module):
+            log_q, q_value = [out.numpy() for out in model(torch.from_numpy(states))]
+        else:
+            log_q, q_value = model(states)
+    kl = (np.exp(log_p) * (log_p - log_q)).sum(axis=1)
+    error = np.abs(value - q_value).ravel()
+    return {"kl_mean": float(kl.mean()), "kl_max": float(kl.max()),
+            "value_error_mean": float(error.mean()), "value_error_max": float(error.max())}
+
+
+def latency(model, states: np.ndarray, number=200):
+    """
+    :return: 每个局面的平均前向时间（秒）
+    """
+    states = torch.from_numpy(np.ascontiguousarray(states, dtype=np.float32))
+    with torch.inference_mode():
+        model(states)
+        start = time.perf_counter()
+        for _ in range(number):
+            model(states)
+    return (time.perf_counter() - start) / number / len(states)
+
+
+if __name__ == '__main__':
+    from gobang.backend.inference_backend import load_backend
+    from gobang.backend.policy_value_net_pytorch import PolicyValueNet
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_file", help="训练保存的模型，如 gobang/resources/current_policy15x15.model")
+    parser.add_argument("--size", type=int, required=True, help="棋盘大小")
+    parser.add_argument("--out-dir", default=None, help="导出目录，默认与模型同目录")
+    parser.add_argument("--modes", nargs="+", default=["dynamic", "static"], help="dynamic, static")
+    parser.add_argument("--games", type=int, default=4, help="校准用的自我对弈局数，另取一半局数作评估")
+    parser.add_argument("--n-playout", type=int, default=200, help="自我对弈每步的模拟次数")
+    parser.add_argument("--engine", default=None, help="量化算子实现，默认torch当前的设置")
+    args = parser.parse_args()
+
+    policy_value_net = PolicyValueNet(args.size, args.size, args.model_file, device="cpu")
+    net = policy_value_net.policy_value_net
+    calibration = self_play_states(policy_value_net.policy_value_fn, args.size, args.size,
+                                   args.games, args.n_playout, seed=0)
+    evaluation = self_play_states(policy_value_net.policy_value_fn, args.size, args.size,
+                                  max(1, args.games // 2), args.n_playout, seed=1)
+    print("calibration positions {}, evaluation positions {}".format(len(calibration), len(evaluation)))
+
+    stem = os.path.splitext(os.path.basename(args.model_file))[0]
+    out_dir = args.out_dir or os.path.dirname(os.path.abspath(args.model_file))
+    print("{:8s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        "model", "batch1 us", "batch16 us", "KL mean", "KL max", "|dv| mean", "|dv| max"))
+    models = {"float": net}
+    for mode in args.modes:
+        if mode == "dynamic":
+            model = quantize_dynamic(net)
+        else:
+            model = quantize_static(net, calibration, engine=args.engine)
+        path = os.path.join(out_dir, "{}_int8_{}.pt".format(stem, mode))
+        save_quantized(model, path)
+        # 报告加载后的TorchScript模型，即对弈时实际运行的模型
+        models[mode] = load_backend(path).module
+        print("{}: {}".format(mode, path))
+    for name, model in models.items():
+        report = compare(net, model, evaluation)
+        print("{:8s} {:10.0f} {:10.0f} {:10.2e} {:10.2e} {:10.2e} {:10.2e}".format(
+            name, latency(model, evaluation[:1]) * 1e6, latency(model, evaluation[:16], 50) * 1e6,
+            report["kl_mean"], report["kl_max"], report["value_error_mean"], report["value_error_max"]))
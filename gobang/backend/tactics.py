@@ -0,0 +1,183 @@
+"""
+MCTS之前的战术检查：一步成五、必须封堵对手的五，以及有限深度的连续冲四取胜（VCF）
+只读board.states，VCF搜索中用do_move/undo_move落子，结束后棋盘复原
+"""
+import random
+import time
+
+from gobang.backend.board import Board
+
+# 四个方向：水平，竖直，主对角线，副对角线
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def _line_count(board: Board, move, player, dh, dw):
+    """
+    假设player落在move，沿(dh, dw)方向及其反方向连续的player棋子数（含move）
+    """
+    states, width, height = board.states, board.width, board.height
+    h0, w0 = divmod(int(move), width)
+    count = 1
+    for sign in (1, -1):
+        h, w = h0 + sign * dh, w0 + sign * dw
+        while 0 <= h < height and 0 <= w < width and states.get(h * width + w) == player:
+            count += 1
+            h, w = h + sign * dh, w + sign * dw
+    return count
+
+
+def makes_five(board: Board, move, player):
+    """
+    player落在空位move后是否连成n子
+    """
+    return any(_line_count(board, move, player, dh, dw) >= board.n_in_row for dh, dw in DIRECTIONS)
+
+
+def _line_empties(board: Board, move, reach):
+    """
+    经过move的四条线上，与move距离不超过reach的空位
+    """
+    states, width, height = board.states, board.width, board.height
+    h0, w0 = divmod(int(move), width)
+    empties = set()
+    for dh, dw in DIRECTIONS:
+        for k in range(-reach, reach + 1):
+            h, w = h0 + k * dh, w0 + k * dw
+            if k and 0 <= h < height and 0 <= w < width and h * width + w not in states:
+                empties.add(h * width + w)
+    return empties
+
+
+def winning_moves(board: Board, player):
+    """
+    player一步就能连成n子的全部位置，只需检查与player棋子相邻的空位
+    :return: List[落子位置]
+    """
+    candidates = set()
+    for move, owner in board.states.items():
+        if owner == player:
+            candidates |= _line_empties(board, move, 1)
+    return sorted(move for move in candidates if makes_five(board, move, player))
+
+
+def _threats_after(board: Board, move, player):
+    """
+    假设player落在move，之后player一步成五的位置（只可能在经过move的线上）
+    """
+    board.states[move] = player
+    try:
+        return [empty for empty in _line_empties(board, move, board.n_in_row - 1)
+                if makes_five(board, empty, player)]
+    finally:
+        del board.states[move]
+
+
+def four_moves(board: Board, player):
+    """
+    player的冲四：落子后下一步能成五的位置
+    :return: List[Tuple(落子位置, 落子后的成五点)]
+    """
+    candidates = set()
+    for move, owner in board.states.items():
+        if owner == player:
+            candidates |= _line_empties(board, move, 2)
+    fours = []
+    for move in sorted(candidates):
+        threats = _threats_after(board, move, player)
+        if threats:
+            fours.append((move, threats))
+    # 先试能同时形成多个成五点的
+    fours.sort(key=lambda four: -len(four[1]))
+    return fours
+
+
+def vcf(board: Board, max_depth=8, max_nodes=5000):
+    """
+    轮到走的一方连续冲四取胜：每一步都冲四，对手只能封堵，最后形成两个成五点或直接成五
+    对手能直接成五时冲四无效
+    :param board: 棋盘局面，搜索中落子、悔棋，结束后复原
+    :param max_depth: 最多冲四的次数
+    :param max_nodes: 最多检查的局面数，超出后放弃
+    :return: 取胜序列的第一步，找不到则为None
+    """
+    player = board.current_player
+    opponent = board.players[0] if player == board.players[1] else board.players[1]
+    budget = [max_nodes]
+
+    def search(depth):
+        if depth == 0:
+            return None
+        opponent_wins = winning_moves(board, opponent)
+        for move, threats in four_moves(board, player):
+            budget[0] -= 1
+            if budget[0] < 0:
+                return None
+            if any(win != move for win in opponent_wins):
+                # 对手有别的成五点，冲四无效
+                continue
+            if len(threats) >= 2:
+                # 双四，对手挡不住
+                return move
+            # 对手只能封堵唯一的成五点，封堵后再继续冲四
+            board.do_move(move)
+            board.do_move(threats[0])
+            found = search(depth - 1)
+            board.undo_move()
+            board.undo_move()
+            if found is not None:
+                return move
+        return None
+
+    return search(max_depth)
+
+
+def forced_move(board: Board, vcf_depth=0, vcf_nodes=5000):
+    """
+    轮到走的一方的强制着法：能一步成五就成五；对手有成五点就封堵；vcf_depth大于0时再找连续冲四取胜
+    :return: 落子位置，没有强制着法时为None
+    """
+    player = board.current_player
+    opponent = board.players[0] if player == board.players[1] else board.players[1]
+    wins = winning_moves(board, player)
+    if wins:
+        return wins[0]
+    blocks = winning_moves(board, opponent)
+    if blocks:
+        # 对手有两个及以上成五点时已经输了，仍封堵其中一个
+        return blocks[0]
+    if vcf_depth > 0:
+        return vcf(board, vcf_depth, vcf_nodes)
+    return None
+
+
+if __name__ == '__main__':
+    from gobang.backend.bitboard import BitBoard
+
+    # 与逐个试落子、用位棋盘整盘判断的结果对照
+    for size, n in ((8, 5), (15, 5), (6, 4)):
+        for seed in range(200):
+            random.seed(seed)
+            board = BitBoard(size, size, n)
+            for _ in range(random.randrange(size * size // 2)):
+                board.do_move(random.choice(board.available))
+                if board.game_end()[0]:
+                    board.undo_move()
+                    break
+            for player in board.players:
+                expected = []
+                for move in board.available.tolist():
+                    if board._has_line(board.bitboards[player] | board._tables.bits[move]):
+                        expected.append(move)
+                assert winning_moves(board, player) == sorted(expected), (size, seed, player)
+        print("{0}x{0}, n_in_row={1}: ok".format(size, n))
+
+    # VCF：随机对局中找到的局面，需要连续冲四三次才能取胜
+    board = Board(15, 15)
+    for move in (49, 94, 113, 153, 54, 101, 53, 123, 176, 145, 69, 79, 97, 173, 128, 95, 141, 171, 115, 63, 169, 160):
+        board.do_move(move)
+    stack = list(board.move_stack)
+    assert vcf(board, max_depth=2) is None
+    start = time.perf_counter()
+    move = forced_move(board, vcf_depth=8)
+    print("vcf: {} in {:.1f} ms".format(board.move_to_location(move), (time.perf_counter() - start) * 1000))
+    assert board.move_stack == stack
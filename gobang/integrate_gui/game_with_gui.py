@@ -13,7 +13,7 @@ from gobang.backend.game import Game
 from gobang.backend.player import PlayerBase, RandomTestPlayer
 from gobang.utils.stoppable_thread import StoppableThread
 from gobang.backend.mcts_alphaZero import MCTSPlayer
-from gobang.backend.policy_value_net_pytorch import PolicyValueNet
+from gobang.backend.policy_value_net_numpy import NumpyPolicyValueNet
 from ui_mainwindow import Ui_MainWindow
 
 human_player_event = threading.Event()
@@ -271,8 +271,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         level = self.get_from_cmb(self.cb_pve_level)
         # func
         self.game.set_board(Board(size, size))
-        game_policy = PolicyValueNet(size, size, model_file="../resources/current_policy{}x{}.model".format(size, size))
-        entity1 = MCTSPlayer(game_policy.policy_value_fn, c_puct=5, n_playout=500)
+        game_policy = NumpyPolicyValueNet(size, size, model_file="../resources/current_policy{}x{}.model".format(size, size))
+        entity1 = MCTSPlayer(game_policy.policy_value_fn, c_puct=5, n_playout=500, eval_cache_size=50000)
 
         # entity1 = RandomTestPlayer(0.001)
         entity2 = QtPlayer(self.game)
@@ -296,9 +296,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # size = 15
         entity1 = RandomTestPlayer(0.001)
         entity2 = RandomTestPlayer(0.001)
-        game_policy1 = PolicyValueNet(size, size, model_file="../resources/current_policy{}x{}.model".format(size, size))
+        game_policy1 = NumpyPolicyValueNet(size, size, model_file="../resources/current_policy{}x{}.model".format(size, size))
         entity1 = MCTSPlayer(game_policy1.policy_value_fn, c_puct=5, n_playout=300)
-        game_policy2 = PolicyValueNet(size, size, model_file="../resources/current_policy{}x{}.model".format(size, size))
+        game_policy2 = NumpyPolicyValueNet(size, size, model_file="../resources/current_policy{}x{}.model".format(size, size))
         entity2 = MCTSPlayer(game_policy2.policy_value_fn, c_puct=5, n_playout=300)
         self.game.new_thread_player(entity1, entity2, 1)
 
@@ -0,0 +1,75 @@
+import copy
+import pickle
+import random
+
+import pytest
+
+from gobang.backend.bitboard import BitBoard
+from gobang.backend.board import Board
+
+SIZES = [(8, 5), (11, 5), (15, 5), (6, 4)]
+
+
+def assert_same(board: Board, bit_board: BitBoard):
+    assert (board.available == bit_board.available).all()
+    assert (board.current_state() == bit_board.current_state()).all()
+    assert board.last_move == bit_board.last_move
+    assert board.current_player == bit_board.current_player
+    assert board.zobrist_key == bit_board.zobrist_key
+    assert board.has_a_winner() == bit_board.has_a_winner()
+    assert board.game_end() == bit_board.game_end(), board.states
+    assert board.pack_board() == bit_board.pack_board()
+
+
+@pytest.mark.parametrize("size, n", SIZES)
+def test_random_games_match_board(size, n):
+    """
+    随机对局，每一步比较两者的判断结果；再悔棋直到空棋盘，每一步都与Board对照
+    """
+    rng = random.Random(size * 10 + n)
+    for _ in range(30):
+        board, bit_board = Board(size, size, n), BitBoard(size, size, n)
+        while not board.game_end()[0]:
+            move = rng.choice(board.available)
+            board.do_move(move)
+            bit_board.do_move(move)
+            assert_same(board, bit_board)
+        while board.move_stack:
+            board.undo_move()
+            bit_board.undo_move()
+            assert_same(board, bit_board)
+        assert bit_board.bitboards == {1: 0, 2: 0}
+
+
+@pytest.mark.parametrize("size, n", SIZES)
+@pytest.mark.parametrize("clone", [copy.deepcopy, lambda board: pickle.loads(pickle.dumps(board))],
+                         ids=["deepcopy", "pickle"])
+def test_copies_continue_like_originals(size, n, clone):
+    """
+    对局中途拷贝（深拷贝或序列化）两种棋盘，拷贝继续落子、悔棋，结果与原棋盘一致，且不影响原棋盘
+    """
+    rng = random.Random(size * 10 + n)
+    for _ in range(10):
+        board, bit_board = Board(size, size, n), BitBoard(size, size, n)
+        for _ in range(rng.randrange(size * size // 3)):
+            move = rng.choice(board.available)
+            board.do_move(move)
+            bit_board.do_move(move)
+            if board.game_end()[0]:
+                break
+        board_copy, bit_board_copy = clone(board), clone(bit_board)
+        assert_same(board_copy, board)
+        assert_same(bit_board_copy, bit_board)
+        snapshot = board.current_state()
+        while not board_copy.game_end()[0]:
+            move = rng.choice(board_copy.available)
+            board_copy.do_move(move)
+            bit_board_copy.do_move(move)
+            assert_same(board_copy, bit_board_copy)
+        while len(board_copy.move_stack) > len(board.move_stack):
+            board_copy.undo_move()
+            bit_board_copy.undo_move()
+            assert_same(board_copy, bit_board_copy)
+        assert_same(board_copy, board)
+        assert (board.current_state() == snapshot).all()
+        assert bit_board_copy.bitboards == bit_board.bitboards
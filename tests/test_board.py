@@ -0,0 +1,57 @@
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from gobang.backend.bitboard import BitBoard
+from gobang.backend.board import Board
+from gobang.backend.mcts_alphaZero import MCTS
+
+
+def play(board: Board, moves):
+    for move in moves:
+        board.do_move(move)
+    return board
+
+
+def plane_policy_value_fn(board: Board):
+    """
+    只从current_state()读取局面的策略价值函数：先验取决于周围3x3内的棋子数，价值取决于双方棋子数之差和最后一步
+    """
+    state = board.current_state()
+    stones = np.pad(state[0] + 2 * state[1], 1)
+    height, width = state.shape[1:]
+    neighbours = sum(stones[i:i + height, j:j + width] for i in range(3) for j in range(3))
+    # 平面的行是上下翻转的，翻回来再按落子位置取
+    priors = 1.0 + neighbours[::-1].ravel()
+    value = np.tanh(0.1 * (state[0].sum() - state[1].sum()) + 0.05 * float(np.argmax(state[2])) / state[2].size)
+    legal = board.legal_moves
+    return zip(legal.tolist(), priors[legal].tolist()), float(value)
+
+
+@pytest.mark.parametrize("cls", [Board, BitBoard])
+@pytest.mark.parametrize("clone", [copy.deepcopy, lambda board: pickle.loads(pickle.dumps(board))])
+def test_copy_keeps_planes_in_sync(cls, clone):
+    board = play(cls(8, 8), [27, 28, 36])
+    copied = clone(board)
+    assert np.array_equal(copied.current_state(), board.current_state())
+    # 拷贝后继续落子、悔棋，特征平面仍与从头落子得到的一致，原棋盘不受影响
+    play(copied, [35, 44])
+    assert np.array_equal(copied.current_state(), play(cls(8, 8), [27, 28, 36, 35, 44]).current_state())
+    assert np.array_equal(board.current_state(), play(cls(8, 8), [27, 28, 36]).current_state())
+    copied.undo_move()
+    assert np.array_equal(copied.current_state(), play(cls(8, 8), [27, 28, 36, 35]).current_state())
+    assert copied.zobrist_key == play(cls(8, 8), [27, 28, 36, 35]).zobrist_key
+
+
+@pytest.mark.parametrize("cls", [Board, BitBoard])
+def test_copy_and_undo_search_build_identical_trees(cls):
+    results = []
+    for undo_search in (True, False):
+        board = play(cls(8, 8), [27, 28, 36, 35])
+        mcts = MCTS(plane_policy_value_fn, 5, 300, undo_search)
+        mcts.get_move_probs(board)
+        results.append(mcts._root_action_visits())
+        assert board.move_stack == play(cls(8, 8), [27, 28, 36, 35]).move_stack
+    assert results[0] == results[1]
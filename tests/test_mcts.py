@@ -0,0 +1,68 @@
+import pytest
+
+from gobang.backend.board import Board
+from gobang.backend.mcts_alphaZero import MCTS
+
+
+def skewed_policy_value_fn(board: Board):
+    """
+    先验随落子位置递增，搜索很快集中到少数几个动作上
+    """
+    legal = board.legal_moves.tolist()
+    total = sum(move + 1 for move in legal)
+    return zip(legal, [(move + 1) / total for move in legal]), 0.0
+
+
+def opening():
+    board = Board(8, 8)
+    for move in (27, 28, 36, 35):
+        board.do_move(move)
+    return board
+
+
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_time_limit_on_reused_root_keeps_searching(n_threads):
+    """
+    根节点已有访问次数（如复用搜索树）时给time_limit，多线程搜索也不能一开始就结束
+    """
+    board = opening()
+    mcts = MCTS(skewed_policy_value_fn, 5, 400, True, n_threads=n_threads)
+    mcts.get_move_probs(board)
+    assert mcts.n_playouts_done == 400
+    mcts.get_move_probs(board, time_limit=2.0)
+    assert mcts.n_playouts_done >= mcts.check_every
+
+
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_without_limits_runs_full_n_playout(n_threads):
+    board = opening()
+    mcts = MCTS(skewed_policy_value_fn, 5, 300, True, n_threads=n_threads)
+    for _ in range(2):
+        mcts.get_move_probs(board)
+        assert mcts.n_playouts_done == 300
+
+
+def skewed_policy_factory():
+    return skewed_policy_value_fn
+
+
+def test_root_parallel_reports_visits_under_new_root():
+    """
+    RootParallelMCTS换根后，_root_action_visits是各子进程复用的子树下的访问次数，而不是上一步的汇总
+    """
+    from gobang.backend.mcts_parallel import RootParallelMCTS
+    board = opening()
+    mcts = RootParallelMCTS(n_playout=200, n_workers=2, policy_factory=skewed_policy_factory)
+    try:
+        mcts.get_move_probs(board)
+        acts, visits = mcts._root_action_visits()
+        assert sum(visits) == 400
+        move = acts[max(range(len(acts)), key=lambda i: visits[i])]
+        child_visits = visits[acts.index(move)]
+        board.do_move(move)
+        mcts.update_with_move(move)
+        # 每个子进程新根节点的第一次访问用于扩展，不计入其下的动作
+        reused = sum(mcts._root_action_visits()[1])
+        assert child_visits - 2 <= reused <= child_visits
+    finally:
+        mcts.close()
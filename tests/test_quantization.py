@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from gobang.backend import quantization  # noqa: E402
+from gobang.backend.policy_value_net_pytorch import Net  # noqa: E402
+
+
+def random_states(n, size, seed):
+    return (np.random.RandomState(seed).rand(n, 4, size, size) < 0.3).astype(np.float32)
+
+
+def test_quantize_static_leaves_caller_model_untouched():
+    """
+    量化只作用于副本：调用方的模型不能被移动到CPU（在GPU上会导致设备不一致），模式和参数也不变
+    """
+    net = Net(8, 8).train()
+    parameters = {name: parameter.detach().clone() for name, parameter in net.named_parameters()}
+
+    def moved():
+        pytest.fail("quantize_static moved the caller's model with .cpu()")
+
+    net.cpu = moved
+    model = quantization.quantize_static(net, random_states(16, 8, 0))
+    del net.cpu
+    assert net.training
+    for name, parameter in net.named_parameters():
+        assert torch.equal(parameter, parameters[name])
+
+    report = quantization.compare(net.eval(), model, random_states(8, 8, 1))
+    assert report["kl_max"] < 1e-2 and report["value_error_max"] < 1e-2
+
+
+def test_quantize_dynamic_leaves_caller_model_untouched():
+    net = Net(8, 8).train()
+    model = quantization.quantize_dynamic(net)
+    assert net.training
+    assert not any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in net.modules())
+    report = quantization.compare(net.eval(), model, random_states(8, 8, 1))
+    assert report["kl_max"] < 1e-2 and report["value_error_max"] < 1e-2